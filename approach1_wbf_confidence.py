@@ -8,35 +8,10 @@ ABORDAGEM 1: WBF com Confiança Baseada em Redundância
 
 import numpy as np
 from ensemble_boxes import weighted_boxes_fusion
-import os
 from pathlib import Path
 from collections import defaultdict
-
-def read_yolo_annotations(txt_path):
-    """Lê anotações YOLO"""
-    boxes, labels = [], []
-    
-    if not os.path.exists(txt_path):
-        return boxes, labels
-    
-    with open(txt_path, 'r') as f:
-        for line in f:
-            parts = line.strip().split()
-            if len(parts) >= 5:
-                class_id = int(parts[0])
-                x_center, y_center = float(parts[1]), float(parts[2])
-                width, height = float(parts[3]), float(parts[4])
-                
-                # Converter para [x1, y1, x2, y2]
-                x1 = x_center - width / 2
-                y1 = y_center - height / 2
-                x2 = x_center + width / 2
-                y2 = y_center + height / 2
-                
-                boxes.append([x1, y1, x2, y2])
-                labels.append(class_id)
-    
-    return boxes, labels
+from iou_utils import (load_annotations, YOLO_FMT, to_yolo_rows,
+                       iou_matrix)
 
 def calculate_iou(box1, box2):
     """Calcula IoU entre duas boxes"""
@@ -55,93 +30,111 @@ def calculate_iou(box1, box2):
     
     return inter_area / union_area if union_area > 0 else 0.0
 
-def calculate_confidence_from_redundancy(boxes, labels, iou_threshold=0.5):
+def calculate_confidence_from_redundancy(boxes, labels, iou_threshold=0.5, iou_mat=None):
     """
     Calcula confiança baseado em redundância
     Mais overlaps = maior confiança (mais anotadores concordam)
+    iou_mat: matriz de IoU já calculada por iou_matrix(boxes, labels) (opcional)
     """
     n = len(boxes)
-    scores = []
+    if n == 0:
+        return []
     
-    for i in range(n):
-        overlaps = []
-        
-        for j in range(n):
-            if i != j and labels[i] == labels[j]:
-                iou = calculate_iou(boxes[i], boxes[j])
-                if iou > iou_threshold:
-                    overlaps.append(iou)
-        
-        # Score baseado em quantidade e qualidade dos overlaps
-        if overlaps:
-            n_overlaps = len(overlaps)
-            avg_iou = np.mean(overlaps)
-            max_iou = np.max(overlaps)
-            
-            # Fórmula: combina quantidade e qualidade
-            # Normalizado entre 0.5 e 1.0
-            score = 0.5 + (min(n_overlaps, 5) / 10) + (avg_iou * 0.3) + (max_iou * 0.1)
-            scores.append(min(1.0, score))
-        else:
-            # Box única, menor confiança (pode ser falso positivo)
-            scores.append(0.3)
-    
-    return scores
+    # IoU já é 0 entre classes diferentes; excluir a própria box
+    iou = iou_matrix(boxes, labels) if iou_mat is None else iou_mat
+    mask = iou > iou_threshold
+    np.fill_diagonal(mask, False)
+    
+    # Score baseado em quantidade e qualidade dos overlaps
+    masked_iou = np.where(mask, iou, 0)
+    n_overlaps = mask.sum(1)
+    avg_iou = masked_iou.sum(1) / np.maximum(n_overlaps, 1)
+    max_iou = masked_iou.max(1)
+    
+    # Fórmula: combina quantidade e qualidade
+    # Normalizado entre 0.5 e 1.0
+    scores = np.clip(0.5 + np.minimum(n_overlaps, 5) / 10 + avg_iou * 0.3 + max_iou * 0.1, 0, 1)
+    
+    # Box única, menor confiança (pode ser falso positivo)
+    scores = np.where(n_overlaps > 0, scores, 0.3)
+    
+    return scores.tolist()
 
 def process_with_wbf(annotation_files, iou_thr=0.55, skip_box_thr=0.35):
     """Processa múltiplas anotações com WBF"""
-    all_boxes, all_scores, all_labels = [], [], []
-    
     # Ler todas as anotações
-    for ann_file in annotation_files:
-        boxes, labels = read_yolo_annotations(ann_file)
-        if boxes:
-            all_boxes.append(boxes)
-            all_labels.append(labels)
+    boxes, labels, counts_per_file = load_annotations(annotation_files)
+    
+    return process_with_wbf_from_arrays(boxes, labels, counts_per_file, iou_thr, skip_box_thr)
+
+def process_with_wbf_from_arrays(boxes, labels, counts_per_file, iou_thr=0.55,
+                                 skip_box_thr=0.35, iou_mat=None):
+    """
+    Mesmo que process_with_wbf, a partir de anotações já lidas
     
-    if not all_boxes:
+    Args:
+        boxes, labels: arrays concatenados de todos os anotadores
+        counts_per_file: quantidade de boxes de cada anotador
+        iou_mat: matriz de IoU já calculada por iou_matrix(boxes, labels) (opcional)
+    """
+    if not len(boxes):
         return [], [], []
     
     # Calcular scores baseado em redundância global
-    flat_boxes = [box for boxes in all_boxes for box in boxes]
-    flat_labels = [label for labels in all_labels for label in labels]
-    confidence_scores = calculate_confidence_from_redundancy(flat_boxes, flat_labels)
-    
-    # Redistribuir scores
-    idx = 0
-    for boxes in all_boxes:
-        n = len(boxes)
-        all_scores.append(confidence_scores[idx:idx + n])
-        idx += n
-    
-    # Aplicar WBF
-    boxes_fused, scores_fused, labels_fused = weighted_boxes_fusion(
-        all_boxes, all_scores, all_labels,
-        weights=None,
-        iou_thr=iou_thr,
-        skip_box_thr=skip_box_thr,
-        conf_type='avg'
-    )
-    
-    return boxes_fused, scores_fused, labels_fused
+    confidence_scores = calculate_confidence_from_redundancy(boxes, labels, iou_mat=iou_mat)
+    
+    # Separar por anotador (o WBF espera uma lista por "modelo"),
+    # ignorando anotadores sem boxes
+    splits = np.cumsum(counts_per_file)[:-1]
+    per_file = [(b, s, l) for b, s, l in zip(np.split(boxes, splits),
+                                             np.split(np.asarray(confidence_scores), splits),
+                                             np.split(labels, splits))
+                if len(b)]
+    
+    def run_wbf(label=None):
+        # Com label, mantém só as boxes daquela classe (mesmo nº de "modelos")
+        all_boxes, all_scores, all_labels = [], [], []
+        for b, s, l in per_file:
+            keep = slice(None) if label is None else (l == label)
+            all_boxes.append(b[keep].tolist())
+            all_scores.append(s[keep].tolist())
+            all_labels.append(l[keep].tolist())
+        
+        return weighted_boxes_fusion(
+            all_boxes, all_scores, all_labels,
+            weights=None,
+            iou_thr=iou_thr,
+            skip_box_thr=skip_box_thr,
+            conf_type='avg'
+        )
+    
+    unique_labels = np.unique(labels)
+    if len(unique_labels) == 1:
+        return run_wbf()
+    
+    # Aplicar WBF por classe (classes não interagem na fusão); sequencial: o WBF segura o GIL
+    # e no batch_processor já roda um processo por imagem
+    results = [run_wbf(label) for label in unique_labels]
+    
+    boxes_fused = np.concatenate([r[0] for r in results])
+    scores_fused = np.concatenate([r[1] for r in results])
+    labels_fused = np.concatenate([r[2] for r in results])
+    
+    # Mesma ordem do WBF: score decrescente
+    order = scores_fused.argsort()[::-1]
+    
+    return boxes_fused[order], scores_fused[order], labels_fused[order]
 
 def save_yolo_format(output_path, boxes, labels, scores=None):
     """Salva no formato YOLO"""
-    lines = []
-    for i, (box, label) in enumerate(zip(boxes, labels)):
-        x1, y1, x2, y2 = box
-        x_center = (x1 + x2) / 2
-        y_center = (y1 + y2) / 2
-        width = x2 - x1
-        height = y2 - y1
-        
-        line = f"{int(label)} {x_center:.6f} {y_center:.6f} {width:.6f} {height:.6f}"
-        if scores is not None:
-            line += f" {scores[i]:.4f}"
-        lines.append(line)
+    rows = to_yolo_rows(boxes, labels)
+    fmt = YOLO_FMT
+    
+    if scores is not None:
+        rows = np.column_stack([rows, np.asarray(scores, dtype=np.float64)])
+        fmt += ' %.4f'
     
-    with open(output_path, 'w') as f:
-        f.write('\n'.join(lines))
+    np.savetxt(output_path, rows, fmt=fmt)
 
 if __name__ == "__main__":
     # Exemplo de uso
@@ -8,32 +8,8 @@ ABORDAGEM 2: Clustering + Consenso por Votação
 
 import numpy as np
 from collections import defaultdict
-import os
-
-def read_yolo_annotations(txt_path):
-    """Lê anotações YOLO"""
-    boxes, labels = [], []
-    
-    if not os.path.exists(txt_path):
-        return boxes, labels
-    
-    with open(txt_path, 'r') as f:
-        for line in f:
-            parts = line.strip().split()
-            if len(parts) >= 5:
-                class_id = int(parts[0])
-                x_center, y_center = float(parts[1]), float(parts[2])
-                width, height = float(parts[3]), float(parts[4])
-                
-                x1 = x_center - width / 2
-                y1 = y_center - height / 2
-                x2 = x_center + width / 2
-                y2 = y_center + height / 2
-                
-                boxes.append([x1, y1, x2, y2])
-                labels.append(class_id)
-    
-    return boxes, labels
+from iou_utils import (load_annotations, format_yolo_lines,
+                       cluster_stats, overlap_candidates, pairs_above_threshold)
 
 def calculate_iou(box1, box2):
     """Calcula IoU"""
@@ -52,49 +28,73 @@ def calculate_iou(box1, box2):
     
     return inter_area / union_area if union_area > 0 else 0.0
 
-def cluster_boxes_by_similarity(boxes, labels, iou_threshold=0.5):
+def cluster_boxes_by_similarity(boxes, labels, iou_threshold=0.5, iou_mat=None, areas=None):
     """
     Agrupa boxes similares em clusters
+    Clusters = componentes conexas do grafo (IoU > threshold, mesma classe),
+    obtidas com Union-Find sobre as arestas
+    iou_mat: matriz de IoU já calculada por iou_matrix(boxes, labels) (opcional)
+    areas: áreas (N,) já calculadas das boxes (opcional)
     Retorna: lista de clusters, cada cluster é lista de índices
     """
     n = len(boxes)
-    visited = [False] * n
-    clusters = []
+    boxes_arr = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    labels_arr = np.asarray(labels)
+    
+    parent = list(range(n))
+    rank = [0] * n
+    
+    def find(x):
+        # Path compression
+        root = x
+        while parent[root] != root:
+            root = parent[root]
+        while parent[x] != root:
+            parent[x], x = root, parent[x]
+        return root
+    
+    def union(a, b):
+        ra, rb = find(a), find(b)
+        if ra == rb:
+            return
+        # Union by rank
+        if rank[ra] < rank[rb]:
+            ra, rb = rb, ra
+        parent[rb] = ra
+        if rank[ra] == rank[rb]:
+            rank[ra] += 1
+    
+    if iou_mat is not None:
+        # Matriz compartilhada já zera pares de classes diferentes
+        edges = np.argwhere(np.triu(iou_mat > iou_threshold, k=1))
+        for a, b in edges.tolist():
+            union(a, b)
+    else:
+        # Pré-filtro espacial: IoU só para pares que se sobrepõem (mesma classe)
+        ii, jj = overlap_candidates(boxes_arr, labels_arr)
+        keep = pairs_above_threshold(boxes_arr, ii, jj, iou_threshold, areas)
+        
+        for a, b in zip(ii[keep].tolist(), jj[keep].tolist()):
+            union(a, b)
     
+    # Agrupar por raiz, mantendo a ordem do menor índice de cada cluster
+    clusters_by_root = defaultdict(list)
     for i in range(n):
-        if visited[i]:
-            continue
-        
-        # Iniciar novo cluster
-        cluster = [i]
-        visited[i] = True
-        
-        # Encontrar todas as boxes similares
-        for j in range(i + 1, n):
-            if visited[j] or labels[i] != labels[j]:
-                continue
-            
-            # Verificar IoU com qualquer box do cluster
-            for idx in cluster:
-                if calculate_iou(boxes[idx], boxes[j]) > iou_threshold:
-                    cluster.append(j)
-                    visited[j] = True
-                    break
-        
-        clusters.append(cluster)
+        clusters_by_root[find(i)].append(i)
     
-    return clusters
+    return list(clusters_by_root.values())
 
 def calculate_cluster_consensus(cluster_indices, boxes, labels, n_annotators):
     """
     Calcula box consenso e score para um cluster
     Score = proporção de anotadores que concordam
     """
-    cluster_boxes = [boxes[i] for i in cluster_indices]
-    cluster_label = labels[cluster_indices[0]]
+    cluster_boxes = np.asarray(boxes)[cluster_indices]
+    cluster_label = int(labels[cluster_indices[0]])
     
-    # Calcular box média (consenso)
-    avg_box = np.mean(cluster_boxes, axis=0).tolist()
+    # Calcular box média (consenso) e variância em uma passada
+    mean_box, variance = cluster_stats(cluster_boxes)
+    avg_box = mean_box.tolist()
     
     # Score = proporção de concordância
     # Se 3 de 5 anotadores concordam, score = 0.6
@@ -103,13 +103,13 @@ def calculate_cluster_consensus(cluster_indices, boxes, labels, n_annotators):
     # Ajustar score baseado na variância do cluster
     # Menor variância = maior confiança
     if len(cluster_indices) > 1:
-        variance = np.var(cluster_boxes, axis=0).mean()
         variance_penalty = min(0.2, variance * 10)  # Penalidade por alta variância
         consensus_score = max(0.1, consensus_score - variance_penalty)
     
     return avg_box, consensus_score, cluster_label
 
-def process_with_clustering(annotation_files, iou_threshold=0.5, min_consensus=0.2):
+def process_with_clustering(annotation_files, iou_threshold=0.5, min_consensus=0.2,
+                            preloaded=None):
     """
     Processa anotações usando clustering e consenso
     
@@ -117,29 +117,40 @@ def process_with_clustering(annotation_files, iou_threshold=0.5, min_consensus=0
         annotation_files: lista de arquivos de anotação
         iou_threshold: threshold para considerar boxes similares
         min_consensus: score mínimo para manter uma box (ex: 0.2 = 20% dos anotadores)
+        preloaded: tupla (boxes, labels) já lida por load_annotations, evita reler os arquivos
     """
-    # Ler todas as anotações
-    all_boxes, all_labels = [], []
-    
-    for ann_file in annotation_files:
-        boxes, labels = read_yolo_annotations(ann_file)
-        all_boxes.extend(boxes)
-        all_labels.extend(labels)
+    # Ler todas as anotações (ou reaproveitar as já lidas)
+    if preloaded is not None:
+        all_boxes, all_labels = preloaded
+    else:
+        all_boxes, all_labels, _ = load_annotations(annotation_files)
+    
+    return process_with_clustering_from_arrays(
+        all_boxes, all_labels, len(annotation_files), iou_threshold, min_consensus
+    )
+
+def process_with_clustering_from_arrays(boxes, labels, n_annotators, iou_threshold=0.5,
+                                        min_consensus=0.2, iou_mat=None):
+    """
+    Mesmo que process_with_clustering, a partir de anotações já lidas
     
-    if not all_boxes:
+    Args:
+        boxes, labels: arrays concatenados de todos os anotadores
+        n_annotators: número de anotadores (arquivos)
+        iou_mat: matriz de IoU já calculada por iou_matrix(boxes, labels) (opcional)
+    """
+    if not len(boxes):
         return [], [], []
     
-    n_annotators = len(annotation_files)
-    
     # Agrupar boxes similares
-    clusters = cluster_boxes_by_similarity(all_boxes, all_labels, iou_threshold)
+    clusters = cluster_boxes_by_similarity(boxes, labels, iou_threshold, iou_mat=iou_mat)
     
     # Calcular consenso para cada cluster
     final_boxes, final_scores, final_labels = [], [], []
     
     for cluster in clusters:
         box, score, label = calculate_cluster_consensus(
-            cluster, all_boxes, all_labels, n_annotators
+            cluster, boxes, labels, n_annotators
         )
         
         # Filtrar por consenso mínimo
@@ -152,28 +163,22 @@ def process_with_clustering(annotation_files, iou_threshold=0.5, min_consensus=0
 
 def save_yolo_format(output_path, boxes, labels, scores=None):
     """Salva no formato YOLO"""
-    lines = []
-    for i, (box, label) in enumerate(zip(boxes, labels)):
-        x1, y1, x2, y2 = box
-        x_center = (x1 + x2) / 2
-        y_center = (y1 + y2) / 2
-        width = x2 - x1
-        height = y2 - y1
-        
-        line = f"{int(label)} {x_center:.6f} {y_center:.6f} {width:.6f} {height:.6f}"
-        if scores is not None:
-            line += f" # consensus: {scores[i]:.2%}"
-        lines.append(line)
+    lines = format_yolo_lines(boxes, labels)
+    if scores is not None:
+        lines = [f"{line} # consensus: {score:.2%}" for line, score in zip(lines, scores)]
     
     with open(output_path, 'w') as f:
         f.write('\n'.join(lines))
 
 def analyze_consensus(annotation_files, iou_threshold=0.5):
     """Analisa estatísticas de consenso"""
-    boxes, scores, labels = process_with_clustering(annotation_files, iou_threshold)
+    all_boxes, all_labels, counts_per_file = load_annotations(annotation_files)
+    boxes, scores, labels = process_with_clustering(
+        annotation_files, iou_threshold, preloaded=(all_boxes, all_labels)
+    )
     
     print(f"\n=== ANÁLISE DE CONSENSO ===")
-    print(f"Total de anotações originais: {sum(len(read_yolo_annotations(f)[0]) for f in annotation_files)}")
+    print(f"Total de anotações originais: {counts_per_file.sum()}")
     print(f"Total após consenso: {len(boxes)}")
     print(f"Score médio: {np.mean(scores):.2%}")
     print(f"Score mínimo: {np.min(scores):.2%}")
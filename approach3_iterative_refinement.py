@@ -7,33 +7,9 @@ ABORDAGEM 3: Refinamento Iterativo com Filtro Adaptativo
 """
 
 import numpy as np
-import os
 from copy import deepcopy
-
-def read_yolo_annotations(txt_path):
-    """Lê anotações YOLO"""
-    boxes, labels = [], []
-    
-    if not os.path.exists(txt_path):
-        return boxes, labels
-    
-    with open(txt_path, 'r') as f:
-        for line in f:
-            parts = line.strip().split()
-            if len(parts) >= 5:
-                class_id = int(parts[0])
-                x_center, y_center = float(parts[1]), float(parts[2])
-                width, height = float(parts[3]), float(parts[4])
-                
-                x1 = x_center - width / 2
-                y1 = y_center - height / 2
-                x2 = x_center + width / 2
-                y2 = y_center + height / 2
-                
-                boxes.append([x1, y1, x2, y2])
-                labels.append(class_id)
-    
-    return boxes, labels
+from iou_utils import (load_annotations, format_yolo_lines,
+                       iou_matrix, iou_1_to_many, cluster_stats)
 
 def calculate_iou(box1, box2):
     """Calcula IoU"""
@@ -52,55 +28,62 @@ def calculate_iou(box1, box2):
     
     return inter_area / union_area if union_area > 0 else 0.0
 
+def similarity_adjacency(boxes, labels, iou_threshold):
+    """
+    Matriz booleana NxN: True onde as boxes são da mesma classe
+    e têm IoU > threshold (inclui a própria box na diagonal)
+    """
+    return iou_matrix(boxes, labels) > iou_threshold
+
 def find_similar_boxes(target_box, target_label, all_boxes, all_labels, iou_threshold):
     """Encontra todas as boxes similares"""
-    similar_indices = []
-    
-    for i, (box, label) in enumerate(zip(all_boxes, all_labels)):
-        if label == target_label:
-            iou = calculate_iou(target_box, box)
-            if iou > iou_threshold:
-                similar_indices.append(i)
-    
-    return similar_indices
+    ious = iou_1_to_many(target_box, all_boxes)
+    same_label = np.asarray(all_labels) == target_label
+    return np.flatnonzero((ious > iou_threshold) & same_label).tolist()
 
 def remove_outliers_mad(boxes, threshold=2.0):
     """
     Remove outliers usando MAD (Median Absolute Deviation)
     Mais robusto que desvio padrão
+    Recebe e retorna um array (N, 4) com as boxes inliers
     """
+    boxes = np.asarray(boxes)
     if len(boxes) <= 2:
-        return list(range(len(boxes)))
+        return boxes
     
-    boxes_array = np.array(boxes)
-    median = np.median(boxes_array, axis=0)
+    median = np.median(boxes, axis=0)
+    abs_dev = np.abs(boxes - median)
     
     # Calcular MAD para cada coordenada
-    mad = np.median(np.abs(boxes_array - median), axis=0)
+    mad = np.median(abs_dev, axis=0)
     
     # Evitar divisão por zero
     mad = np.where(mad == 0, 1e-6, mad)
     
-    # Calcular score de desvio para cada box
-    deviations = np.abs(boxes_array - median) / mad
-    max_deviation = np.max(deviations, axis=1)
-    
-    # Manter boxes com desvio menor que threshold
-    inliers = np.where(max_deviation < threshold)[0].tolist()
+    # Manter boxes com desvio máximo menor que threshold
+    mask = (abs_dev / mad).max(1) < threshold
     
-    return inliers if inliers else [0]  # Manter pelo menos uma
+    return boxes[mask] if mask.any() else boxes[:1]  # Manter pelo menos uma
 
-def iterative_refinement(boxes, labels, iou_threshold=0.5, max_iterations=3):
+def iterative_refinement(boxes, labels, iou_threshold=0.5, max_iterations=3, iou_mat=None):
     """
     Refina boxes iterativamente removendo outliers
+    iou_mat: matriz de IoU já calculada por iou_matrix(boxes, labels) (opcional)
     
     Retorna:
         refined_boxes: boxes refinadas
         stability_scores: score baseado em estabilidade
         refined_labels: labels correspondentes
     """
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
     n = len(boxes)
-    processed = [False] * n
+    processed = np.zeros(n, dtype=bool)
+    
+    # Matriz de similaridade calculada uma única vez
+    if iou_mat is not None:
+        adj = iou_mat > iou_threshold
+    else:
+        adj = similarity_adjacency(boxes, labels, iou_threshold)
     
     refined_boxes = []
     stability_scores = []
@@ -111,33 +94,30 @@ def iterative_refinement(boxes, labels, iou_threshold=0.5, max_iterations=3):
             continue
         
         # Encontrar grupo de boxes similares
-        similar_indices = find_similar_boxes(
-            boxes[i], labels[i], boxes, labels, iou_threshold
-        )
+        similar_indices = np.flatnonzero(adj[i])
         
-        if not similar_indices:
+        if not len(similar_indices):
             continue
         
         # Marcar como processadas
-        for idx in similar_indices:
-            processed[idx] = True
+        processed[similar_indices] = True
         
         # Refinamento iterativo
-        current_boxes = [boxes[idx] for idx in similar_indices]
+        current_boxes = boxes[similar_indices]
         iteration_history = [current_boxes]
         
         for iteration in range(max_iterations):
             # Remover outliers
-            inlier_indices = remove_outliers_mad(current_boxes, threshold=2.5)
-            current_boxes = [current_boxes[idx] for idx in inlier_indices]
+            current_boxes = remove_outliers_mad(current_boxes, threshold=2.5)
             
             if len(current_boxes) <= 1:
                 break
             
             iteration_history.append(current_boxes)
         
-        # Calcular box final (média das inliers)
-        final_box = np.mean(current_boxes, axis=0).tolist()
+        # Calcular box final (média das inliers) e variância
+        final_mean, final_var = cluster_stats(current_boxes)
+        final_box = final_mean.tolist()
         
         # Calcular score de estabilidade
         # Baseado em: quantidade de boxes, variância, e convergência
@@ -146,13 +126,13 @@ def iterative_refinement(boxes, labels, iou_threshold=0.5, max_iterations=3):
         retention_rate = n_final / n_boxes  # Proporção mantida após filtro
         
         # Variância das boxes finais
-        variance = np.var(current_boxes, axis=0).mean() if len(current_boxes) > 1 else 0
+        variance = final_var if len(current_boxes) > 1 else 0
         
         # Score de convergência (mudança entre iterações)
         if len(iteration_history) > 1:
-            initial_var = np.var(iteration_history[0], axis=0).mean()
-            final_var = np.var(iteration_history[-1], axis=0).mean()
-            convergence = 1.0 - (final_var / (initial_var + 1e-6))
+            _, initial_var = cluster_stats(iteration_history[0])
+            _, last_var = cluster_stats(iteration_history[-1])
+            convergence = 1.0 - (last_var / (initial_var + 1e-6))
             convergence = max(0, min(1, convergence))
         else:
             convergence = 0.5
@@ -167,12 +147,13 @@ def iterative_refinement(boxes, labels, iou_threshold=0.5, max_iterations=3):
         
         refined_boxes.append(final_box)
         stability_scores.append(stability)
-        refined_labels.append(labels[i])
+        refined_labels.append(int(labels[i]))
     
     return refined_boxes, stability_scores, refined_labels
 
 def process_with_iterative_refinement(annotation_files, iou_threshold=0.5, 
-                                     min_stability=0.3, max_iterations=3):
+                                     min_stability=0.3, max_iterations=3,
+                                     preloaded=None):
     """
     Processa anotações com refinamento iterativo
     
@@ -181,21 +162,34 @@ def process_with_iterative_refinement(annotation_files, iou_threshold=0.5,
         iou_threshold: threshold de IoU
         min_stability: score mínimo de estabilidade
         max_iterations: número máximo de iterações de refinamento
+        preloaded: tupla (boxes, labels) já lida por load_annotations, evita reler os arquivos
     """
-    # Ler todas as anotações
-    all_boxes, all_labels = [], []
-    
-    for ann_file in annotation_files:
-        boxes, labels = read_yolo_annotations(ann_file)
-        all_boxes.extend(boxes)
-        all_labels.extend(labels)
+    # Ler todas as anotações (ou reaproveitar as já lidas)
+    if preloaded is not None:
+        all_boxes, all_labels = preloaded
+    else:
+        all_boxes, all_labels, _ = load_annotations(annotation_files)
+    
+    return process_with_iterative_refinement_from_arrays(
+        all_boxes, all_labels, iou_threshold, min_stability, max_iterations
+    )
+
+def process_with_iterative_refinement_from_arrays(boxes, labels, iou_threshold=0.5,
+                                                  min_stability=0.3, max_iterations=3,
+                                                  iou_mat=None):
+    """
+    Mesmo que process_with_iterative_refinement, a partir de anotações já lidas
     
-    if not all_boxes:
+    Args:
+        boxes, labels: arrays concatenados de todos os anotadores
+        iou_mat: matriz de IoU já calculada por iou_matrix(boxes, labels) (opcional)
+    """
+    if not len(boxes):
         return [], [], []
     
     # Aplicar refinamento iterativo
     refined_boxes, stability_scores, refined_labels = iterative_refinement(
-        all_boxes, all_labels, iou_threshold, max_iterations
+        boxes, labels, iou_threshold, max_iterations, iou_mat=iou_mat
     )
     
     # Filtrar por estabilidade mínima
@@ -211,37 +205,26 @@ def process_with_iterative_refinement(annotation_files, iou_threshold=0.5,
 
 def save_yolo_format(output_path, boxes, labels, scores=None):
     """Salva no formato YOLO"""
-    lines = []
-    for i, (box, label) in enumerate(zip(boxes, labels)):
-        x1, y1, x2, y2 = box
-        x_center = (x1 + x2) / 2
-        y_center = (y1 + y2) / 2
-        width = x2 - x1
-        height = y2 - y1
-        
-        line = f"{int(label)} {x_center:.6f} {y_center:.6f} {width:.6f} {height:.6f}"
-        if scores is not None:
-            line += f" # stability: {scores[i]:.3f}"
-        lines.append(line)
+    lines = format_yolo_lines(boxes, labels)
+    if scores is not None:
+        lines = [f"{line} # stability: {score:.3f}" for line, score in zip(lines, scores)]
     
     with open(output_path, 'w') as f:
         f.write('\n'.join(lines))
 
 def analyze_refinement(annotation_files, iou_threshold=0.5):
     """Analisa processo de refinamento"""
-    all_boxes = []
-    for f in annotation_files:
-        boxes, _ = read_yolo_annotations(f)
-        all_boxes.extend(boxes)
+    all_boxes, all_labels, counts_per_file = load_annotations(annotation_files)
+    n_original = counts_per_file.sum()
     
     boxes, scores, labels = process_with_iterative_refinement(
-        annotation_files, iou_threshold
+        annotation_files, iou_threshold, preloaded=(all_boxes, all_labels)
     )
     
     print(f"\n=== ANÁLISE DE REFINAMENTO ===")
-    print(f"Anotações originais: {len(all_boxes)}")
+    print(f"Anotações originais: {n_original}")
     print(f"Após refinamento: {len(boxes)}")
-    print(f"Redução: {(1 - len(boxes)/len(all_boxes))*100:.1f}%")
+    print(f"Redução: {(1 - len(boxes)/n_original)*100:.1f}%")
     print(f"\nEstabilidade média: {np.mean(scores):.3f}")
     print(f"Estabilidade mínima: {np.min(scores):.3f}")
     print(f"Estabilidade máxima: {np.max(scores):.3f}")
@@ -6,41 +6,166 @@ Processa todos os arquivos de anotação e compara as 3 abordagens
 import os
 from pathlib import Path
 import json
-from collections import defaultdict
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 import numpy as np
 
 # Importar as 3 abordagens
-from approach1_wbf_confidence import process_with_wbf
-from approach2_clustering_consensus import process_with_clustering
-from approach3_iterative_refinement import process_with_iterative_refinement
+from approach1_wbf_confidence import process_with_wbf_from_arrays
+from approach2_clustering_consensus import process_with_clustering_from_arrays
+from approach3_iterative_refinement import process_with_iterative_refinement_from_arrays
+from iou_utils import load_annotations, iou_matrix, to_yolo_rows, YOLO_FMT
+from iou_backend import iou_matrix_batch
 
 def group_annotations_by_image(label_folders):
     """
     Agrupa arquivos de anotação por imagem
     Assume que arquivos com mesmo nome são da mesma imagem
     """
-    image_annotations = defaultdict(list)
+    image_annotations = {}
     
     for folder in label_folders:
-        if not os.path.exists(folder):
+        # scandir já traz nome e caminho de cada entrada, sem listdir + join
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    name = entry.name
+                    if name.endswith('.txt'):
+                        image_annotations.setdefault(name[:-4], []).append(entry.path)
+        except FileNotFoundError:
             continue
-        
-        for filename in os.listdir(folder):
-            if filename.endswith('.txt'):
-                image_id = filename.replace('.txt', '')
-                filepath = os.path.join(folder, filename)
-                image_annotations[image_id].append(filepath)
     
     return image_annotations
 
-def process_all_images(image_annotations, output_dir, approach='all'):
+# Abordagens disponíveis: nome -> (rótulo para mensagens, função)
+# Cada função recebe (boxes, labels, counts_per_file, iou_mat) já lidos
+APPROACHES = {
+    'wbf': ('WBF', lambda boxes, labels, counts, iou_mat:
+            process_with_wbf_from_arrays(boxes, labels, counts, iou_mat=iou_mat)),
+    'clustering': ('Clustering', lambda boxes, labels, counts, iou_mat:
+                   process_with_clustering_from_arrays(boxes, labels, len(counts),
+                                                       iou_mat=iou_mat)),
+    'iterative': ('Iterative', lambda boxes, labels, counts, iou_mat:
+                  process_with_iterative_refinement_from_arrays(boxes, labels,
+                                                                iou_mat=iou_mat)),
+}
+
+def process_all_fused(ann_files, approaches=tuple(APPROACHES), image_id='', loaded=None):
+    """
+    Processa uma imagem com as abordagens escolhidas em uma única passada:
+    lê cada arquivo uma vez e calcula uma única matriz de IoU compartilhada
+    Uma abordagem que falha é reportada e não impede as demais
+    
+    Args:
+        loaded: (boxes, labels, counts_per_file, iou_mat) já calculados, ex. pelo
+                backend em lote de process_all_images (opcional)
+    
+    Retorna: {abordagem: (boxes, scores, labels)}
+    """
+    if loaded is not None:
+        boxes, labels, counts_per_file, iou_mat = loaded
+    else:
+        boxes, labels, counts_per_file, areas = load_annotations(ann_files, return_areas=True)
+        
+        # IoU de todos os pares (0 entre classes diferentes), reutilizada pelas 3 abordagens
+        iou_mat = iou_matrix(boxes, labels, areas=areas)
+    
+    fused = {}
+    for name in approaches:
+        display_name, process_fn = APPROACHES[name]
+        try:
+            fused[name] = process_fn(boxes, labels, counts_per_file, iou_mat)
+        except Exception as e:
+            print(f"\nErro {display_name} em {image_id}: {e}")
+    
+    return fused
+
+def _process_one(item, output_dir, approach):
+    """
+    Processa uma única imagem (executado em um processo do pool)
+    Retorna: (image_id, {abordagem: resultado})
+    """
+    image_id, ann_files, loaded = item
+    image_results = {}
+    approaches = tuple(APPROACHES) if approach == 'all' else (approach,)
+    
+    try:
+        fused = process_all_fused(ann_files, approaches, image_id, loaded)
+    except Exception as e:
+        print(f"\nErro em {image_id}: {e}")
+        return image_id, image_results
+    
+    for name, (boxes, scores, labels) in fused.items():
+        try:
+            image_results[name] = {
+                'n_boxes': len(boxes),
+                'avg_score': float(np.mean(scores)) if len(scores) else 0,
+                'boxes': boxes,
+                'scores': scores,
+                'labels': labels
+            }
+            
+            # Salvar
+            output_path = os.path.join(output_dir, name, f'{image_id}.txt')
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            save_results(output_path, boxes, labels, scores)
+        except Exception as e:
+            print(f"\nErro {APPROACHES[name][0]} em {image_id}: {e}")
+    
+    return image_id, image_results
+
+def _batched_work_items(work_items, iou_device, iou_batch_size):
+    """
+    Agrupa as imagens em lotes de processamento
+    Sem iou_device: um único lote e cada processo lê e calcula sua própria matriz de IoU
+    Com iou_device: as anotações de cada lote são lidas aqui e as matrizes de IoU de
+    todas as imagens do lote saem de uma única chamada a iou_matrix_batch
+    """
+    if iou_device is None:
+        yield [(image_id, ann_files, None) for image_id, ann_files in work_items]
+        return
+    
+    device = None if iou_device == 'auto' else iou_device
+    
+    for start in range(0, len(work_items), iou_batch_size):
+        chunk = work_items[start:start + iou_batch_size]
+        
+        parsed = {}
+        for image_id, ann_files in chunk:
+            try:
+                parsed[image_id] = load_annotations(ann_files)
+            except Exception as e:
+                # O processo da imagem tenta de novo e reporta o erro
+                print(f"\nErro ao ler {image_id}: {e}")
+        
+        try:
+            iou_mats = iou_matrix_batch([p[0] for p in parsed.values()],
+                                        [p[1] for p in parsed.values()], device=device)
+        except Exception as e:
+            # Sem o lote (ex. memória da GPU), cada processo calcula sua matriz
+            print(f"\nErro no IoU em lote: {e}")
+            iou_mats = [None] * len(parsed)
+        
+        loaded = {image_id: (*p, iou_mat) if iou_mat is not None else None
+                  for (image_id, p), iou_mat in zip(parsed.items(), iou_mats)}
+        yield [(image_id, ann_files, loaded.get(image_id)) for image_id, ann_files in chunk]
+
+def process_all_images(image_annotations, output_dir, approach='all', max_workers=None,
+                       iou_device=None, iou_batch_size=64):
     """
     Processa todas as imagens com a(s) abordagem(ns) escolhida(s)
+    As imagens são independentes, então são distribuídas entre processos
     
     Args:
         image_annotations: dict {image_id: [list of annotation files]}
         output_dir: diretório de saída
         approach: 'wbf', 'clustering', 'iterative', ou 'all'
+        max_workers: número de processos (padrão: os.cpu_count())
+        iou_device: None (IoU por imagem, em cada processo), 'auto', 'cuda' ou 'cpu'
+                    para calcular o IoU de iou_batch_size imagens por vez com o
+                    iou_backend (PyTorch; sem ele, cai para iou_utils.iou_matrix)
+        iou_batch_size: imagens por chamada do IoU em lote
     """
     os.makedirs(output_dir, exist_ok=True)
     
@@ -50,88 +175,33 @@ def process_all_images(image_annotations, output_dir, approach='all'):
         'iterative': {}
     }
     
-    total_images = len(image_annotations)
+    # Pular imagens com só 1 anotação (sem redundância)
+    work_items = [(image_id, ann_files)
+                  for image_id, ann_files in image_annotations.items()
+                  if len(ann_files) >= 2]
+    total_images = len(work_items)
     
-    for idx, (image_id, ann_files) in enumerate(image_annotations.items(), 1):
-        print(f"\rProcessando {idx}/{total_images}: {image_id}", end='')
-        
-        # Pular se só tem 1 anotação (sem redundância)
-        if len(ann_files) < 2:
-            continue
-        
-        # Abordagem 1: WBF
-        if approach in ['wbf', 'all']:
-            try:
-                boxes, scores, labels = process_with_wbf(ann_files)
-                results['wbf'][image_id] = {
-                    'n_boxes': len(boxes),
-                    'avg_score': float(np.mean(scores)) if scores else 0,
-                    'boxes': boxes,
-                    'scores': scores,
-                    'labels': labels
-                }
-                
-                # Salvar
-                output_path = os.path.join(output_dir, 'wbf', f'{image_id}.txt')
-                os.makedirs(os.path.dirname(output_path), exist_ok=True)
-                save_results(output_path, boxes, labels, scores)
-            except Exception as e:
-                print(f"\nErro WBF em {image_id}: {e}")
-        
-        # Abordagem 2: Clustering
-        if approach in ['clustering', 'all']:
-            try:
-                boxes, scores, labels = process_with_clustering(ann_files)
-                results['clustering'][image_id] = {
-                    'n_boxes': len(boxes),
-                    'avg_score': float(np.mean(scores)) if scores else 0,
-                    'boxes': boxes,
-                    'scores': scores,
-                    'labels': labels
-                }
-                
-                output_path = os.path.join(output_dir, 'clustering', f'{image_id}.txt')
-                os.makedirs(os.path.dirname(output_path), exist_ok=True)
-                save_results(output_path, boxes, labels, scores)
-            except Exception as e:
-                print(f"\nErro Clustering em {image_id}: {e}")
-        
-        # Abordagem 3: Iterative
-        if approach in ['iterative', 'all']:
-            try:
-                boxes, scores, labels = process_with_iterative_refinement(ann_files)
-                results['iterative'][image_id] = {
-                    'n_boxes': len(boxes),
-                    'avg_score': float(np.mean(scores)) if scores else 0,
-                    'boxes': boxes,
-                    'scores': scores,
-                    'labels': labels
-                }
+    worker = partial(_process_one, output_dir=output_dir, approach=approach)
+    
+    # spawn, não fork: fork depois de qualquer kernel Numba paralelo (ou CUDA) já executado
+    # neste processo, como o IoU em lote ou uma chamada anterior a iou_matrix, trava os workers
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(),
+                             mp_context=multiprocessing.get_context('spawn')) as executor:
+        idx = 0
+        for batch in _batched_work_items(work_items, iou_device, iou_batch_size):
+            for image_id, image_results in executor.map(worker, batch, chunksize=8):
+                idx += 1
+                print(f"\rProcessando {idx}/{total_images}: {image_id}", end='')
                 
-                output_path = os.path.join(output_dir, 'iterative', f'{image_id}.txt')
-                os.makedirs(os.path.dirname(output_path), exist_ok=True)
-                save_results(output_path, boxes, labels, scores)
-            except Exception as e:
-                print(f"\nErro Iterative em {image_id}: {e}")
+                for name, entry in image_results.items():
+                    results[name][image_id] = entry
     
     print("\n\nProcessamento concluído!")
     return results
 
 def save_results(output_path, boxes, labels, scores):
     """Salva resultados no formato YOLO"""
-    lines = []
-    for box, label, score in zip(boxes, labels, scores):
-        x1, y1, x2, y2 = box
-        x_center = (x1 + x2) / 2
-        y_center = (y1 + y2) / 2
-        width = x2 - x1
-        height = y2 - y1
-        
-        line = f"{int(label)} {x_center:.6f} {y_center:.6f} {width:.6f} {height:.6f}"
-        lines.append(line)
-    
-    with open(output_path, 'w') as f:
-        f.write('\n'.join(lines))
+    np.savetxt(output_path, to_yolo_rows(boxes, labels), fmt=YOLO_FMT)
 
 def compare_approaches(results):
     """Compara estatísticas das 3 abordagens"""
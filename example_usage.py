@@ -79,12 +79,14 @@ def example_batch_processing():
     # Diretório com suas anotações
     label_dir = 'labels/labels/test'
     
-    if not os.path.exists(label_dir):
+    # Listar todos os arquivos (scandir já traz o caminho completo de cada entrada)
+    try:
+        with os.scandir(label_dir) as entries:
+            all_files = [entry.path for entry in entries if entry.name.endswith('.txt')]
+    except FileNotFoundError:
         print(f"⚠️  Diretório não encontrado: {label_dir}")
         return
     
-    # Listar todos os arquivos
-    all_files = [f for f in os.listdir(label_dir) if f.endswith('.txt')]
     print(f"\nEncontrados {len(all_files)} arquivos de anotação")
     
     # Processar primeiros 5 arquivos como exemplo
@@ -98,8 +100,8 @@ def example_batch_processing():
         'iterative': []
     }
     
-    for filename in sample_files:
-        filepath = os.path.join(label_dir, filename)
+    for filepath in sample_files:
+        filename = os.path.basename(filepath)
         
         # Para este exemplo, cada arquivo é tratado individualmente
         # Na prática, você agruparia arquivos da mesma imagem
@@ -1,8 +1,20 @@
 import os
-import glob
 import json
+from pathlib import Path
 import numpy as np
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from tqdm import tqdm
+from iou_utils import pairs_iou, box_areas
+from approach2_clustering_consensus import cluster_boxes_by_similarity
+
+# orjson (opcional) serializa arrays NumPy direto, sem .tolist()
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
 
 # --- Funções de Geometria (Mesmas de antes) ---
 def yolo_to_x1y1x2y2(yolo_box):
@@ -14,130 +26,172 @@ def yolo_to_x1y1x2y2(yolo_box):
     return [x1, y1, x2, y2]
 
 def x1y1x2y2_to_yolo(box):
-    x1, y1, x2, y2 = box
-    w = x2 - x1
-    h = y2 - y1
-    xc = x1 + w / 2
-    yc = y1 + h / 2
-    return [xc, yc, w, h]
+    # Aceita uma box (4,) ou várias (N, 4) de uma vez
+    box = np.asarray(box, dtype=np.float64)
+    wh = box[..., 2:4] - box[..., 0:2]
+    c = box[..., 0:2] + wh / 2
+    return np.concatenate((c, wh), axis=-1)
 
 def calculate_iou(box1, box2):
-    x1 = max(box1[0], box2[0])
-    y1 = max(box1[1], box2[1])
-    x2 = min(box1[2], box2[2])
-    y2 = min(box1[3], box2[3])
-    intersection = max(0, x2 - x1) * max(0, y2 - y1)
-    area1 = (box1[2] - box1[0]) * (box1[3] - box1[1])
-    area2 = (box2[2] - box2[0]) * (box2[3] - box2[1])
+    ax1, ay1, ax2, ay2 = box1
+    bx1, by1, bx2, by2 = box2
+    
+    # Caso mais comum: boxes sem sobreposição, retorna antes de qualquer cálculo
+    if ax2 <= bx1 or bx2 <= ax1 or ay2 <= by1 or by2 <= ay1:
+        return 0.0
+    
+    # Comparações diretas em vez de max()/min() (sem chamadas de função)
+    x1 = ax1 if ax1 > bx1 else bx1
+    y1 = ay1 if ay1 > by1 else by1
+    x2 = ax2 if ax2 < bx2 else bx2
+    y2 = ay2 if ay2 < by2 else by2
+    intersection = (x2 - x1) * (y2 - y1) # Positiva: já há sobreposição
+    area1 = (ax2 - ax1) * (ay2 - ay1)
+    area2 = (bx2 - bx1) * (by2 - by1)
     union = area1 + area2 - intersection
     return intersection / union if union > 0 else 0
 
+def parse_yolo_lines(lines):
+    """Converte linhas YOLO em um array (N, 5) com np.loadtxt (colunas extras são ignoradas)"""
+    if not lines:
+        return np.empty((0, 5))
+    return np.loadtxt(lines, ndmin=2, usecols=range(5), comments=None)
+
+def iter_txt(folder):
+    """Caminhos dos .txt de uma pasta via os.scandir (nome e tipo vêm da listagem, sem stat extra)"""
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.name.endswith('.txt') and entry.is_file():
+                yield entry.path
+
 # --- Lógica Principal ---
 
-def process_annotations(input_folder, output_txt_folder, output_json_path):
-    # Dicionário que vai virar o JSON final
-    # Estrutura: { "nome_imagem": { "boxes": [], "scores": [], "labels": [] } }
-    wbf_data = {}
+def process_file(file_path, output_txt_folder):
+    """
+    Processa um arquivo de anotações: salva o TXT com as médias e
+    retorna (image_id, entrada do JSON ou None se não houver boxes)
+    output_txt_folder: Path da pasta de saída (já existente)
+    """
+    filename = os.path.basename(file_path)
+    image_id = filename[:-4] # Remove extensão .txt para usar como ID
+    
+    # 1. Ler anotações originais
+    with open(file_path, 'r') as f:
+        # Guarda texto original para salvar depois
+        original_lines = [line.strip() for line in f if line.strip()]
+    
+    # Parsing de todas as linhas de uma vez: class xc yc w h
+    try:
+        data = parse_yolo_lines(original_lines)
+    except ValueError:
+        # Linhas com menos de 5 colunas: ignora só as inválidas
+        original_lines = [line for line in original_lines if len(line.split()) >= 5]
+        data = parse_yolo_lines(original_lines)
+    
+    parsed_labels = data[:, 0].astype(int)
+    boxes_arr = np.hstack((data[:, 1:3] - data[:, 3:5] / 2,
+                           data[:, 1:3] + data[:, 3:5] / 2)) # [x1, y1, x2, y2]
 
-    if not os.path.exists(output_txt_folder):
-        os.makedirs(output_txt_folder)
+    # 2. Encontrar clusters e calcular médias (Lógica de Consistência)
+    # Vamos gerar APENAS as novas caixas médias aqui
+    new_mean_rows = np.empty((0, 5)) # Para salvar no TXT
+    
+    # Arrays para o JSON (formato WBF: normalizado x1,y1,x2,y2)
+    wbf_boxes = np.empty((0, 4))
+    wbf_scores = np.empty(0)
+    wbf_labels = np.empty(0, dtype=int)
+
+    if len(boxes_arr):
+        # Áreas (FP32, como o IoU) calculadas uma vez, usadas no agrupamento e no score
+        areas = box_areas(boxes_arr.astype(np.float32))
+        
+        # Clusters = componentes conexas do grafo (IoU > 0.5, mesma classe),
+        # na ordem do menor índice de cada cluster
+        clusters = cluster_boxes_by_similarity(boxes_arr, parsed_labels, iou_threshold=0.5, areas=areas)
+        members = np.concatenate(clusters) # Índices agrupados cluster a cluster
+        sizes = np.array([len(c) for c in clusters])
+        starts = np.cumsum(sizes) - sizes
+        comp = np.repeat(np.arange(len(clusters)), sizes) # Cluster de cada índice em `members`
+        
+        # --- A MÁGICA: Gera a Média e o Score ---
+        # Soma por cluster em uma única redução, sem montar um array por cluster
+        mean_boxes = np.add.reduceat(boxes_arr[members], starts, axis=0) / sizes[:, None]
+        
+        # Score = Média dos IoUs entre a caixa média e as originais do cluster
+        # (IoU de cada box contra a média do seu cluster, em um único lote)
+        stacked = np.concatenate((mean_boxes, boxes_arr))
+        stacked_areas = np.concatenate((box_areas(mean_boxes.astype(np.float32)), areas))
+        member_ious = pairs_iou(stacked, comp, len(clusters) + members, stacked_areas)
+        scores = np.add.reduceat(member_ious.astype(np.float64), starts) / sizes
+        
+        # Prepara dados para o JSON (WBF)
+        wbf_boxes = mean_boxes # [x1, y1, x2, y2]
+        wbf_scores = scores
+        wbf_labels = parsed_labels[members[starts]]
+        
+        # Prepara linhas para o TXT (YOLO: class xc yc w h)
+        new_mean_rows = np.column_stack((wbf_labels, x1y1x2y2_to_yolo(wbf_boxes)))
+
+    # 3. Salvar novo arquivo TXT (Originais + Novas Médias)
+    out_txt_path = output_txt_folder / filename
+    with open(out_txt_path, 'w') as f_out:
+        # Escreve as originais primeiro, em uma única escrita
+        f_out.writelines(line + "\n" for line in original_lines)
+        
+        # Escreve as novas médias (adicionadas ao final), formatadas pelo np.savetxt
+        # Por padrão YOLO não aceita comentários, então vai apenas a linha.
+        np.savetxt(f_out, new_mean_rows, fmt='%d %.6f %.6f %.6f %.6f')
 
-    files = glob.glob(os.path.join(input_folder, "*.txt"))
+    # 4. Entrada desta imagem para o JSON
+    if not len(wbf_boxes):
+        return image_id, None
+    
+    return image_id, {
+        "boxes": wbf_boxes,   # Array (N, 4) [x1, y1, x2, y2]
+        "scores": wbf_scores, # Array (N,) de floats
+        "labels": wbf_labels  # Array (N,) de ints
+    }
+
+def encode_entry(image_id, entry):
+    """Serializa uma entrada do JSON ('"image_id": {...}') em bytes"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(image_id) + b": " + orjson.dumps(entry, option=orjson.OPT_SERIALIZE_NUMPY)
+    
+    entry = {key: value.tolist() for key, value in entry.items()}
+    return (json.dumps(image_id) + ": " + json.dumps(entry)).encode()
+
+def process_annotations(input_folder, output_txt_folder, output_json_path, max_workers=None):
+    # Estrutura do JSON final: { "nome_imagem": { "boxes": [], "scores": [], "labels": [] } }
+    # Escrito em streaming, uma imagem por vez, sem acumular tudo em memória
+    # Os arquivos são independentes: processados em paralelo (max_workers processos, padrão os.cpu_count())
+
+    input_folder = Path(input_folder)
+    output_txt_folder = Path(output_txt_folder)
+    output_txt_folder.mkdir(parents=True, exist_ok=True)
+
+    # Uma única verificação da pasta; os arquivos listados existem
+    files = list(iter_txt(input_folder)) if input_folder.is_dir() else []
     
     print(f"Processando {len(files)} arquivos...")
+    print(f"Salvando arquivo JSON para WBF em: {output_json_path}")
 
-    for file_path in tqdm(files):
-        filename = os.path.basename(file_path)
-        image_id = filename.replace('.txt', '') # Remove extensão para usar como ID
+    with open(output_json_path, 'wb') as f_json:
+        f_json.write(b"{\n")
+        separator = b""
         
-        # 1. Ler anotações originais
-        original_lines = []
-        parsed_boxes = [] # [x1, y1, x2, y2]
-        parsed_labels = []
+        worker = partial(process_file, output_txt_folder=output_txt_folder)
         
-        with open(file_path, 'r') as f:
-            lines = f.readlines()
-            for line in lines:
-                parts = line.strip().split()
-                if len(parts) < 5: continue
-                
-                cls = int(parts[0])
-                coords = list(map(float, parts[1:5])) # xc, yc, w, h
+        # spawn, não fork: fork depois de um kernel Numba paralelo já executado neste processo trava os workers
+        with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(),
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            for image_id, entry in tqdm(executor.map(worker, files, chunksize=32), total=len(files)):
+                if entry is None:
+                    continue
                 
-                original_lines.append(line.strip()) # Guarda texto original para salvar depois
-                parsed_boxes.append(yolo_to_x1y1x2y2(coords))
-                parsed_labels.append(cls)
-
-        # 2. Encontrar clusters e calcular médias (Lógica de Consistência)
-        # Vamos gerar APENAS as novas caixas médias aqui
-        new_mean_boxes_yolo = [] # Para salvar no TXT
+                f_json.write(separator + encode_entry(image_id, entry))
+                separator = b",\n"
         
-        # Listas para o JSON (formato WBF: normalizado x1,y1,x2,y2)
-        wbf_boxes = []
-        wbf_scores = []
-        wbf_labels = []
-
-        if parsed_boxes:
-            used = [False] * len(parsed_boxes)
-            
-            for i in range(len(parsed_boxes)):
-                if used[i]: continue
-                
-                # Cria cluster
-                cluster = [parsed_boxes[i]]
-                used[i] = True
-                curr_label = parsed_labels[i]
-                
-                # Busca vizinhos
-                for j in range(i + 1, len(parsed_boxes)):
-                    if not used[j] and parsed_labels[j] == curr_label:
-                        if calculate_iou(parsed_boxes[i], parsed_boxes[j]) > 0.5:
-                            cluster.append(parsed_boxes[j])
-                            used[j] = True
-                
-                # --- A MÁGICA: Gera a Média e o Score ---
-                mean_box = np.mean(np.array(cluster), axis=0).tolist()
-                
-                # Score = Média dos IoUs entre a caixa média e as originais do cluster
-                ious = [calculate_iou(mean_box, b) for b in cluster]
-                score = float(np.mean(ious))
-                
-                # Prepara dados para o JSON (WBF)
-                wbf_boxes.append(mean_box) # [x1, y1, x2, y2]
-                wbf_scores.append(score)
-                wbf_labels.append(int(curr_label))
-                
-                # Prepara linha para o TXT (YOLO: class xc yc w h)
-                # Opcional: Adicionei o score na linha para você ver, mas formato padrão é 5 colunas
-                yolo_mean = x1y1x2y2_to_yolo(mean_box)
-                line_str = f"{int(curr_label)} {yolo_mean[0]:.6f} {yolo_mean[1]:.6f} {yolo_mean[2]:.6f} {yolo_mean[3]:.6f}"
-                new_mean_boxes_yolo.append(line_str)
-
-        # 3. Salvar novo arquivo TXT (Originais + Novas Médias)
-        out_txt_path = os.path.join(output_txt_folder, filename)
-        with open(out_txt_path, 'w') as f_out:
-            # Escreve as originais primeiro
-            for line in original_lines:
-                f_out.write(line + "\n")
-            
-            # Escreve as novas médias (adicionadas ao final)
-            for line in new_mean_boxes_yolo:
-                # Dica: Adicionei um comentário ou identificador visual se quiser? 
-                # Por padrão YOLO não aceita comentários, então vai apenas a linha.
-                f_out.write(line + "\n")
-
-        # 4. Salvar dados no dicionário para JSON
-        if wbf_boxes:
-            wbf_data[image_id] = {
-                "boxes": wbf_boxes,   # Lista de listas [x1, y1, x2, y2]
-                "scores": wbf_scores, # Lista de floats
-                "labels": wbf_labels  # Lista de ints
-            }
-
-    # 5. Escrever o arquivo JSON final
-    print(f"Salvando arquivo JSON para WBF em: {output_json_path}")
-    with open(output_json_path, 'w') as f_json:
-        json.dump(wbf_data, f_json, indent=4)
+        f_json.write(b"\n}\n")
 
 # --- CONFIGURAÇÃO ---
 PASTA_ENTRADA = "labels/labels/train"
@@ -1,9 +1,21 @@
 import os
 import json
 import glob
+from pathlib import Path
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy as np
 from tqdm import tqdm
 from ensemble_boxes import weighted_boxes_fusion
 
+# orjson (opcional) decodifica o JSON bem mais rápido que o json da stdlib
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
 # --- Configurações ---
 ARQUIVO_JSON_ENTRADA = "dados_para_wbf.json"  # O arquivo gerado no script anterior
 PASTA_SAIDA_FINAL = "resultado_final_wbf"     # Onde os txts finais serão salvos
@@ -17,81 +29,125 @@ def x1y1x2y2_to_yolo(box):
     """
     Converte coordenadas normalizadas (x1, y1, x2, y2) 
     para formato YOLO (xc, yc, w, h).
+    Aceita uma box (4,) ou todas as boxes (N, 4) de uma vez.
+    """
+    box = np.asarray(box, dtype=np.float64)
+    wh = box[..., 2:4] - box[..., 0:2]
+    c = box[..., 0:2] + wh / 2
+    return np.concatenate((c, wh), axis=-1)
+
+# --- WBF compartilhado (usado também por gera_yoloformat.py) ---
+
+def wbf_single(content, iou_thr=IOU_THRESHOLD, skip_box_thr=SKIP_BOX_THR):
+    """
+    Roda o WBF nas caixas de uma imagem do JSON.
+    Retorna (boxes_final, scores_final, labels_final); vazios se não houver caixas.
     """
-    x1, y1, x2, y2 = box
-    w = x2 - x1
-    h = y2 - y1
-    xc = x1 + w / 2
-    yc = y1 + h / 2
-    return [xc, yc, w, h]
+    # Extrai as listas do JSON
+    boxes = content['boxes']   # Já estão em [x1, y1, x2, y2] normalizado
+    scores = content['scores']
+    labels = content['labels']
+
+    if len(boxes) == 0:
+        return [], [], []
+
+    # --- PREPARAÇÃO PARA WBF ---
+    # A biblioteca espera uma lista de listas (uma lista para cada modelo).
+    # Como consolidamos tudo em um único "modelo mestre", encapsulamos em []:
+    return weighted_boxes_fusion(
+        [boxes],
+        [scores],
+        [labels],
+        weights=[1], # Peso 1, pois é o único input
+        iou_thr=iou_thr,
+        skip_box_thr=skip_box_thr,
+        conf_type='avg' # Se houver fusão, tira a média dos scores
+    )
+
+# Formatos de linha (6 casas decimais para precisão); np.savetxt formata todas as linhas em C
+SCORED_FMT = '%d %.6f %.6f %.6f %.6f %.6f'  # class score xc yc w h
+CLEAN_FMT = '%d %.6f %.6f %.6f %.6f'        # class xc yc w h
+
+def yolo_columns(boxes_final):
+    """Converte as boxes finais de volta para YOLO: array (N, 4) xc, yc, w, h"""
+    return x1y1x2y2_to_yolo(np.reshape(boxes_final, (-1, 4)))
+
+def write_scored_txt(output_path, fused):
+    """Salva no formato: class score xc yc w h"""
+    boxes_final, scores_final, labels_final = fused
+    rows = np.column_stack((labels_final, scores_final, yolo_columns(boxes_final)))
+    np.savetxt(output_path, rows, fmt=SCORED_FMT)
+
+def write_clean_txt(output_path, fused):
+    """Salva no formato YOLO padrão, sem score: class xc yc w h"""
+    boxes_final, _, labels_final = fused
+    rows = np.column_stack((labels_final, yolo_columns(boxes_final)))
+    np.savetxt(output_path, rows, fmt=CLEAN_FMT)
+
+def _wbf_one(item, writers):
+    """Worker: roda o WBF de uma imagem e grava os TXTs; retorna a mensagem de erro, se houver"""
+    image_id, content = item
+
+    # --- RODA O WBF ---
+    try:
+        fused = wbf_single(content)
+    except Exception as e:
+        return f"Erro ao processar imagem {image_id}: {e}"
+
+    # --- SALVA O RESULTADO ---
+    # Sem caixas para esta imagem: os writers geram um txt vazio
+    for folder, write_txt in writers:
+        write_txt(folder / f"{image_id}.txt", fused)
+    return None
 
 # --- Execução Principal ---
 
-def run_wbf_and_save(json_path, output_folder):
+def run_wbf_outputs(json_path, scored_folder=None, clean_folder=None, max_workers=None):
+    """
+    Carrega o JSON uma vez, roda o WBF uma vez por imagem e grava,
+    a partir do mesmo resultado, os formatos pedidos:
+    - scored_folder: TXTs com score (class score xc yc w h)
+    - clean_folder: TXTs YOLO limpos (class xc yc w h)
+    As imagens são independentes, então são distribuídas entre max_workers processos
+    """
     # Verifica se o arquivo JSON existe
     if not os.path.exists(json_path):
         print(f"Erro: O arquivo {json_path} não foi encontrado.")
         return
 
-    # Cria a pasta de saída
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
+    # Cria as pastas de saída
+    writers = []
+    if scored_folder is not None:
+        writers.append((Path(scored_folder), write_scored_txt))
+    if clean_folder is not None:
+        writers.append((Path(clean_folder), write_clean_txt))
+    for folder, _ in writers:
+        folder.mkdir(parents=True, exist_ok=True)
 
     print("Carregando dados do JSON...")
-    with open(json_path, 'r') as f:
-        data = json.load(f)
+    if ORJSON_AVAILABLE:
+        with open(json_path, 'rb') as f:
+            data = orjson.loads(f.read())
+    else:
+        with open(json_path, 'r') as f:
+            data = json.load(f)
 
     total_images = len(data)
     print(f"Iniciando WBF em {total_images} imagens...")
 
-    # Itera sobre cada imagem no JSON
-    for image_id, content in tqdm(data.items(), desc="Aplicando WBF"):
-        
-        # Extrai as listas do JSON
-        boxes = content['boxes']   # Já estão em [x1, y1, x2, y2] normalizado
-        scores = content['scores']
-        labels = content['labels']
-
-        # Se não houver caixas para esta imagem, cria um txt vazio e pula
-        if len(boxes) == 0:
-            open(os.path.join(output_folder, f"{image_id}.txt"), 'w').close()
-            continue
-
-        # --- PREPARAÇÃO PARA WBF ---
-        # A biblioteca espera uma lista de listas (uma lista para cada modelo).
-        # Como consolidamos tudo em um único "modelo mestre", encapsulamos em []:
-        boxes_list = [boxes]
-        scores_list = [scores]
-        labels_list = [labels]
-        weights = [1] # Peso 1, pois é o único input
-
-        # --- RODA O WBF ---
-        try:
-            boxes_final, scores_final, labels_final = weighted_boxes_fusion(
-                boxes_list,
-                scores_list,
-                labels_list,
-                weights=weights,
-                iou_thr=IOU_THRESHOLD,
-                skip_box_thr=SKIP_BOX_THR,
-                conf_type='avg' # Se houver fusão, tira a média dos scores
-            )
-        except Exception as e:
-            print(f"Erro ao processar imagem {image_id}: {e}")
-            continue
-
-        # --- SALVA O RESULTADO ---
-        output_path = os.path.join(output_folder, f"{image_id}.txt")
-        
-        with open(output_path, 'w') as f_out:
-            for b, s, l in zip(boxes_final, scores_final, labels_final):
-                # Converte de volta para YOLO (xc, yc, w, h) para salvar
-                yolo_box = x1y1x2y2_to_yolo(b)
-                
-                # Formato final: class score xc yc w h
-                # Usamos 6 casas decimais para precisão
-                line = f"{int(l)} {s:.6f} {yolo_box[0]:.6f} {yolo_box[1]:.6f} {yolo_box[2]:.6f} {yolo_box[3]:.6f}\n"
-                f_out.write(line)
+    # Itera sobre cada imagem no JSON, em paralelo
+    worker = partial(_wbf_one, writers=writers)
+
+    # spawn, não fork: fork depois de um kernel Numba paralelo já executado neste processo trava os workers
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(),
+                             mp_context=multiprocessing.get_context('spawn')) as executor:
+        results = executor.map(worker, data.items(), chunksize=32)
+        for error in tqdm(results, total=total_images, desc="Aplicando WBF"):
+            if error:
+                print(error)
+
+def run_wbf_and_save(json_path, output_folder, max_workers=None):
+    run_wbf_outputs(json_path, scored_folder=output_folder, max_workers=max_workers)
 
 if __name__ == "__main__":
     run_wbf_and_save(ARQUIVO_JSON_ENTRADA, PASTA_SAIDA_FINAL)
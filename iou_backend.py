@@ -0,0 +1,80 @@
+"""
+BACKEND DE IoU EM GPU (PyTorch)
+Matriz de IoU calculada com tensores, para processar muitas imagens de uma vez
+- Usa CUDA automaticamente quando disponível
+- Sem PyTorch ou sem GPU, cai para iou_utils.iou_matrix (Numba/NumPy)
+"""
+
+import numpy as np
+from iou_utils import iou_matrix
+
+try:
+    import torch
+    TORCH_AVAILABLE = True
+except ImportError:
+    TORCH_AVAILABLE = False
+
+def default_device():
+    """'cuda' se houver GPU disponível, senão None (usa o caminho NumPy)"""
+    if TORCH_AVAILABLE and torch.cuda.is_available():
+        return 'cuda'
+    return None
+
+def iou_matrix_torch(boxes):
+    """
+    Matriz de IoU entre boxes [x1, y1, x2, y2]
+    
+    Args:
+        boxes: Tensor (..., N, 4); dimensões extras à esquerda são tratadas como batch
+    Retorna: Tensor (..., N, N)
+    """
+    area = (boxes[..., 2] - boxes[..., 0]) * (boxes[..., 3] - boxes[..., 1])
+    
+    lt = torch.max(boxes[..., :, None, :2], boxes[..., None, :, :2])
+    rb = torch.min(boxes[..., :, None, 2:], boxes[..., None, :, 2:])
+    wh = (rb - lt).clamp(min=0)
+    inter = wh[..., 0] * wh[..., 1]
+    
+    union = area[..., :, None] + area[..., None, :] - inter
+    safe_union = torch.where(union > 0, union, torch.ones_like(union))
+    
+    return torch.where(union > 0, inter / safe_union, torch.zeros_like(inter))
+
+def iou_matrix_batch(boxes_list, labels_list, device=None):
+    """
+    Calcula a matriz de IoU de várias imagens em uma única chamada
+    As imagens são empilhadas com padding até o maior N
+    
+    Args:
+        boxes_list: lista de arrays (N_i, 4)
+        labels_list: lista de arrays (N_i,); classes diferentes recebem IoU 0
+        device: 'cuda', 'cpu' ou None (auto: GPU se disponível, senão NumPy);
+                sem PyTorch, sempre o caminho NumPy
+    Retorna: lista de arrays (N_i, N_i) float32, como iou_utils.iou_matrix
+    """
+    if device is None:
+        device = default_device()
+    
+    if not TORCH_AVAILABLE or device is None or not boxes_list:
+        return [iou_matrix(b, l) for b, l in zip(boxes_list, labels_list)]
+    
+    sizes = [len(b) for b in boxes_list]
+    n_max = max(sizes)
+    
+    # Padding: boxes de área 0 (IoU 0) e classe -1
+    boxes = np.zeros((len(boxes_list), n_max, 4), dtype=np.float32)
+    labels = np.full((len(boxes_list), n_max), -1, dtype=np.int64)
+    for k, (b, l) in enumerate(zip(boxes_list, labels_list)):
+        boxes[k, :sizes[k]] = np.asarray(b, dtype=np.float32).reshape(-1, 4)
+        labels[k, :sizes[k]] = l
+    
+    boxes_t = torch.from_numpy(boxes).to(device)
+    labels_t = torch.from_numpy(labels).to(device)
+    
+    with torch.no_grad():
+        iou = iou_matrix_torch(boxes_t)
+        same_label = labels_t[:, :, None] == labels_t[:, None, :]
+        iou = torch.where(same_label, iou, torch.zeros_like(iou))
+    
+    iou = iou.cpu().numpy()
+    return [np.ascontiguousarray(iou[k, :n, :n]) for k, n in enumerate(sizes)]
@@ -0,0 +1,406 @@
+"""
+UTILITÁRIOS DE IoU
+Código compartilhado pelas 3 abordagens: leitura das anotações e
+kernels para calcular IoU entre boxes
+- Usa Numba (compilado, paralelo) quando disponível
+- Cai para NumPy com broadcasting caso contrário
+- Número de threads do Numba controlado pela variável NUMBA_NUM_THREADS
+"""
+
+import io
+import os
+import numpy as np
+import warnings
+from functools import lru_cache
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+def _empty_annotations():
+    return np.empty((0, 4), dtype=np.float32), np.empty(0, dtype=np.int32)
+
+def box_areas(boxes):
+    """Áreas (N,) float32 de boxes [x1, y1, x2, y2]"""
+    return (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+
+def _read_yolo_lines(txt_path):
+    """Leitura linha a linha, tolerante a linhas com menos de 5 colunas"""
+    rows = []
+    with open(txt_path, 'r') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 5:
+                rows.append([float(p) for p in parts[:5]])
+    return np.array(rows, dtype=np.float32).reshape(-1, 5)
+
+def read_yolo_annotations(txt_path):
+    """
+    Lê anotações YOLO
+    Retorna arrays contíguos: boxes (N, 4) float32 [x1, y1, x2, y2] e labels (N,) int32
+    """
+    try:
+        with warnings.catch_warnings():
+            # Arquivo vazio gera aviso do loadtxt; tratamos como 0 boxes
+            warnings.simplefilter('ignore', UserWarning)
+            data = np.loadtxt(txt_path, dtype=np.float32, ndmin=2, usecols=range(5))
+    except OSError:
+        # Arquivo inexistente
+        return _empty_annotations()
+    except ValueError:
+        # Linhas malformadas: ignora só as linhas inválidas
+        data = _read_yolo_lines(txt_path)
+    
+    if data.size == 0:
+        return _empty_annotations()
+    
+    labels = data[:, 0].astype(np.int32)
+    cx, cy = data[:, 1], data[:, 2]
+    half_w, half_h = data[:, 3] * 0.5, data[:, 4] * 0.5
+    
+    # Converter para [x1, y1, x2, y2]
+    boxes = np.empty((len(data), 4), dtype=np.float32)
+    boxes[:, 0] = cx - half_w
+    boxes[:, 1] = cy - half_h
+    boxes[:, 2] = cx + half_w
+    boxes[:, 3] = cy + half_h
+    
+    return boxes, labels
+
+@lru_cache(maxsize=1024)
+def _read_cached(txt_path, mtime_ns, size, inode):
+    """
+    Leitura memorizada por (caminho, mtime, tamanho, inode): um arquivo reescrito dentro da
+    resolução do mtime ainda muda de chave se mudar de tamanho ou for substituído
+    Arrays somente-leitura pois são compartilhados
+    As áreas das boxes são calculadas aqui, uma vez por arquivo
+    """
+    boxes, labels = read_yolo_annotations(txt_path)
+    areas = box_areas(boxes)
+    for arr in (boxes, labels, areas):
+        arr.flags.writeable = False
+    return boxes, labels, areas
+
+def clear_annotation_cache():
+    """Esvazia o cache de load_annotations (ex. depois de reescrever arquivos no lugar)"""
+    _read_cached.cache_clear()
+
+def load_annotations(annotation_files, return_areas=False):
+    """
+    Lê e concatena as anotações de uma imagem
+    Arquivos já lidos (e não modificados) vêm de um cache em memória, então
+    chamar várias abordagens sobre os mesmos arquivos lê o disco uma vez só
+    (clear_annotation_cache() descarta o cache)
+    
+    Retorna: boxes (N, 4), labels (N,) e quantidade de boxes por arquivo
+             (+ áreas (N,) das boxes se return_areas=True)
+    """
+    parsed = []
+    
+    for ann_file in annotation_files:
+        try:
+            st = os.stat(ann_file)
+        except OSError:
+            boxes, labels = _empty_annotations()
+            parsed.append((boxes, labels, box_areas(boxes)))
+        else:
+            parsed.append(_read_cached(ann_file, st.st_mtime_ns, st.st_size, st.st_ino))
+    
+    counts_per_file = np.array([len(p[0]) for p in parsed], dtype=np.int64)
+    
+    # Um único buffer do tamanho final, preenchido por fatias
+    all_boxes = np.empty((counts_per_file.sum(), 4), dtype=np.float32)
+    all_labels = np.empty(counts_per_file.sum(), dtype=np.int32)
+    all_areas = np.empty(counts_per_file.sum(), dtype=np.float32)
+    
+    offset = 0
+    for (boxes, labels, areas), count in zip(parsed, counts_per_file):
+        all_boxes[offset:offset + count] = boxes
+        all_labels[offset:offset + count] = labels
+        all_areas[offset:offset + count] = areas
+        offset += count
+    
+    if return_areas:
+        return all_boxes, all_labels, counts_per_file, all_areas
+    return all_boxes, all_labels, counts_per_file
+
+# Formato de uma linha YOLO: class x_center y_center width height
+YOLO_FMT = '%d %.6f %.6f %.6f %.6f'
+
+def to_yolo_rows(boxes, labels):
+    """Converte boxes [x1, y1, x2, y2] em um array (N, 5): class, xc, yc, w, h"""
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    
+    rows = np.empty((len(boxes), 5))
+    rows[:, 0] = labels
+    rows[:, 1:3] = (boxes[:, :2] + boxes[:, 2:]) / 2
+    rows[:, 3:5] = boxes[:, 2:] - boxes[:, :2]
+    
+    return rows
+
+def format_yolo_lines(boxes, labels):
+    """Formata todas as boxes como linhas YOLO de uma vez (np.savetxt)"""
+    buf = io.StringIO()
+    np.savetxt(buf, to_yolo_rows(boxes, labels), fmt=YOLO_FMT)
+    return buf.getvalue().splitlines()
+
+if NUMBA_AVAILABLE:
+    @njit(fastmath=True, cache=True, parallel=True)
+    def _iou_matrix_kernel(boxes, labels, areas, out):
+        """Escreve a matriz NxN de IoU em `out` (0 entre classes diferentes)"""
+        n = boxes.shape[0]
+    
+        for i in prange(n):
+            ax1 = boxes[i, 0]
+            ay1 = boxes[i, 1]
+            ax2 = boxes[i, 2]
+            ay2 = boxes[i, 3]
+            area_a = areas[i]
+    
+            for j in range(n):
+                if labels[i] != labels[j]:
+                    out[i, j] = 0.0
+                    continue
+    
+                x1 = max(ax1, boxes[j, 0])
+                y1 = max(ay1, boxes[j, 1])
+                x2 = min(ax2, boxes[j, 2])
+                y2 = min(ay2, boxes[j, 3])
+    
+                if x2 < x1 or y2 < y1:
+                    out[i, j] = 0.0
+                    continue
+    
+                inter = (x2 - x1) * (y2 - y1)
+                union = area_a + areas[j] - inter
+                out[i, j] = inter / union if union > 0 else 0.0
+
+# Acima desta fração de pares candidatos, o cálculo denso compensa
+DENSE_FRACTION = 0.5
+
+# Matrizes maiores que TILE_MIN x TILE_MIN são calculadas em blocos TILE x TILE
+TILE = 64
+TILE_MIN = 256
+
+def overlap_candidates(boxes, labels=None):
+    """
+    Pré-filtro espacial: pares (i, j), i < j, da mesma classe cujos
+    retângulos se sobrepõem em x e em y. Os demais pares têm IoU 0.
+    
+    Retorna: (ii, jj) arrays de índices
+    """
+    b = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    
+    x_overlap = (b[:, None, 0] < b[None, :, 2]) & (b[:, None, 2] > b[None, :, 0])
+    y_overlap = (b[:, None, 1] < b[None, :, 3]) & (b[:, None, 3] > b[None, :, 1])
+    cand = x_overlap & y_overlap
+    
+    if labels is not None:
+        labels = np.asarray(labels)
+        cand &= labels[:, None] == labels[None, :]
+    
+    return np.nonzero(np.triu(cand, k=1))
+
+def pairs_iou(boxes, ii, jj, areas=None):
+    """IoU apenas dos pares (ii[k], jj[k]), sem montar a matriz NxN"""
+    b = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    if areas is None:
+        areas = box_areas(b)
+    
+    bi, bj = np.take(b, ii, axis=0), np.take(b, jj, axis=0)
+    inter_wh = (np.minimum(bi[:, 2:], bj[:, 2:]) - np.maximum(bi[:, :2], bj[:, :2])).clip(0)
+    inter_area = inter_wh[:, 0] * inter_wh[:, 1]
+    union = np.take(areas, ii) + np.take(areas, jj) - inter_area
+    
+    return np.where(union > 0, inter_area / np.where(union > 0, union, 1), 0)
+
+def pairs_above_threshold(boxes, ii, jj, iou_threshold, areas=None):
+    """
+    Máscara dos pares (ii[k], jj[k]) com IoU > iou_threshold, em dois estágios:
+    1. Limite barato pelas áreas: IoU <= menor área / maior área,
+       então pares com razão de áreas <= threshold são descartados sem interseção
+    2. IoU exato (FP32) só para os pares restantes
+    """
+    b = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    ii, jj = np.asarray(ii), np.asarray(jj)
+    if areas is None:
+        areas = box_areas(b)
+    
+    ai, aj = np.take(areas, ii), np.take(areas, jj)
+    small, large = np.minimum(ai, aj), np.maximum(ai, aj)
+    maybe = small > iou_threshold * large
+    
+    mask = np.zeros(len(ii), dtype=bool)
+    mask[maybe] = pairs_iou(b, ii[maybe], jj[maybe], areas) > iou_threshold
+    
+    return mask
+
+def _iou_matrix_dense(boxes, labels, areas, out):
+    """Matriz completa via broadcasting NumPy"""
+    inter_wh = (np.minimum(boxes[:, None, 2:], boxes[None, :, 2:]) -
+                np.maximum(boxes[:, None, :2], boxes[None, :, :2])).clip(0)
+    inter_area = inter_wh.prod(-1)
+    union = areas[:, None] + areas[None, :] - inter_area
+    
+    iou = np.where(union > 0, inter_area / np.where(union > 0, union, 1), 0)
+    out[:] = np.where(labels[:, None] == labels[None, :], iou, 0)
+
+def _iou_matrix_numpy(boxes, labels, areas, out):
+    """
+    Mesmo cálculo do kernel Numba, via NumPy
+    Calcula IoU só nos pares que passam no pré-filtro espacial;
+    em cenas densas cai para a matriz completa
+    """
+    n = len(boxes)
+    ii, jj = overlap_candidates(boxes, labels)
+    
+    if len(ii) > DENSE_FRACTION * n * (n - 1) / 2:
+        if n > TILE_MIN:
+            _iou_matrix_tiled(boxes, labels, areas, out)
+        else:
+            _iou_matrix_dense(boxes, labels, areas, out)
+        return
+    
+    ious = pairs_iou(boxes, ii, jj, areas)
+    
+    out[:] = 0
+    out[ii, jj] = ious
+    out[jj, ii] = ious
+    out[np.arange(n), np.arange(n)] = areas > 0
+
+def _iou_matrix_tiled(boxes, labels, areas, out, block=TILE):
+    """
+    Matriz completa calculada em blocos (block, block) que cabem no cache L2
+    Só os blocos acima da diagonal são calculados; os demais são espelhados
+    """
+    n = len(boxes)
+    
+    # Rascunhos reutilizados por todos os blocos
+    lt = np.empty((block, block, 2), dtype=np.float32)
+    wh = np.empty((block, block, 2), dtype=np.float32)
+    inter = np.empty((block, block), dtype=np.float32)
+    union = np.empty((block, block), dtype=np.float32)
+    
+    for i0 in range(0, n, block):
+        i1 = min(i0 + block, n)
+        bi, ai, li = boxes[i0:i1], areas[i0:i1], labels[i0:i1]
+        
+        for j0 in range(i0, n, block):
+            j1 = min(j0 + block, n)
+            bj = boxes[j0:j1]
+            h, w = i1 - i0, j1 - j0
+            t_lt, t_wh, t_inter, t_union = lt[:h, :w], wh[:h, :w], inter[:h, :w], union[:h, :w]
+            
+            np.maximum(bi[:, None, :2], bj[None, :, :2], out=t_lt)
+            np.minimum(bi[:, None, 2:], bj[None, :, 2:], out=t_wh)
+            np.subtract(t_wh, t_lt, out=t_wh)
+            np.clip(t_wh, 0, None, out=t_wh)
+            np.multiply(t_wh[..., 0], t_wh[..., 1], out=t_inter)
+            np.add(ai[:, None], areas[None, j0:j1], out=t_union)
+            np.subtract(t_union, t_inter, out=t_union)
+            
+            tile = out[i0:i1, j0:j1]
+            tile[:] = 0
+            np.divide(t_inter, t_union, out=tile, where=t_union > 0)
+            tile[li[:, None] != labels[None, j0:j1]] = 0
+            
+            if j0 != i0:
+                out[j0:j1, i0:i1] = tile.T
+
+def iou_matrix(boxes, labels=None, out=None, areas=None):
+    """
+    Calcula a matriz NxN de IoU entre todas as boxes
+    
+    Args:
+        boxes: array (N, 4) no formato [x1, y1, x2, y2]
+        labels: classes (N,); pares de classes diferentes recebem IoU 0
+        out: buffer (N, N) float32 pré-alocado (opcional)
+        areas: áreas (N,) já calculadas, ex. por load_annotations (opcional)
+    """
+    boxes = np.ascontiguousarray(boxes, dtype=np.float32).reshape(-1, 4)
+    n = len(boxes)
+    
+    if labels is None:
+        labels = np.zeros(n, dtype=np.int32)
+    else:
+        labels = np.ascontiguousarray(labels, dtype=np.int32)
+    
+    if areas is None:
+        areas = box_areas(boxes)
+    else:
+        areas = np.ascontiguousarray(areas, dtype=np.float32)
+    
+    if out is None:
+        out = np.empty((n, n), dtype=np.float32)
+    
+    if NUMBA_AVAILABLE:
+        _iou_matrix_kernel(boxes, labels, areas, out)
+    else:
+        _iou_matrix_numpy(boxes, labels, areas, out)
+    
+    return out
+
+def iou_1_to_many(box, others):
+    """
+    IoU de uma box contra M boxes em lote (operações vetoriais FP32)
+    
+    Args:
+        box: array (4,) [x1, y1, x2, y2]
+        others: array (M, 4)
+    Retorna: array (M,) float32
+    """
+    box = np.asarray(box, dtype=np.float32).reshape(4)
+    others = np.ascontiguousarray(others, dtype=np.float32).reshape(-1, 4)
+    
+    inter_wh = (np.minimum(box[2:], others[:, 2:]) -
+                np.maximum(box[:2], others[:, :2])).clip(0)
+    inter_area = inter_wh[:, 0] * inter_wh[:, 1]
+    
+    box_area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (others[:, 2] - others[:, 0]) * (others[:, 3] - others[:, 1])
+    union = box_area + areas - inter_area
+    
+    return np.where(union > 0, inter_area / np.where(union > 0, union, 1), 0).astype(np.float32)
+
+def _cluster_stats_python(arr):
+    """Média por coordenada e variância média de um cluster (N, 4)"""
+    return arr.mean(axis=0), float(arr.var(axis=0).mean())
+
+if NUMBA_AVAILABLE:
+    @njit(cache=True)
+    def _cluster_stats_kernel(arr):
+        """Versão compilada: somas escalares em vez de chamadas np.mean/np.var"""
+        n = arr.shape[0]
+        mean = np.zeros(4)
+        
+        for i in range(n):
+            for k in range(4):
+                mean[k] += arr[i, k]
+        for k in range(4):
+            mean[k] /= n
+        
+        var_sum = 0.0
+        for i in range(n):
+            for k in range(4):
+                d = arr[i, k] - mean[k]
+                var_sum += d * d
+        
+        return mean, var_sum / (n * 4)
+
+def cluster_stats(arr):
+    """
+    Estatísticas de um cluster pequeno de boxes
+    
+    Args:
+        arr: array (N, 4) com N >= 1
+    Retorna: (média por coordenada (4,), média das variâncias das 4 coordenadas)
+    """
+    arr = np.ascontiguousarray(arr, dtype=np.float32).reshape(-1, 4)
+    
+    if NUMBA_AVAILABLE:
+        mean, var_mean = _cluster_stats_kernel(arr)
+        return mean, float(var_mean)
+    
+    return _cluster_stats_python(arr)
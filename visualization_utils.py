@@ -3,15 +3,111 @@ UTILITÁRIOS DE VISUALIZAÇÃO
 Funções para visualizar e comparar resultados das diferentes abordagens
 """
 
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-import numpy as np
-from collections import Counter
 import os
+import sys
+import numpy as np
+from functools import lru_cache
+
+# Paleta tab10 do matplotlib em RGBA (sem importar o matplotlib); cor de uma classe = _TAB10_RGBA[label % 10]
+_TAB10_RGBA = np.column_stack((np.array([
+    (31, 119, 180), (255, 127, 14), (44, 160, 44), (214, 39, 40), (148, 103, 189),
+    (140, 86, 75), (227, 119, 194), (127, 127, 127), (188, 189, 34), (23, 190, 207),
+]) / 255, np.ones(10)))
+
+# Labels das boxes; o fundo branco segue o antigo bbox=dict(boxstyle='round,pad=0.3')
+LABEL_FONTSIZE = 8
+LABEL_PAD = 0.3  # em frações do tamanho da fonte
+
+def _pyplot():
+    """
+    Importa o matplotlib só quando um gráfico é gerado (print_statistics não precisa dele)
+    Na primeira importação, sem display (servidor/batch) e sem backend escolhido pelo usuário: Agg
+    """
+    if 'matplotlib.pyplot' not in sys.modules:
+        import matplotlib
+        if (sys.platform.startswith('linux') and 'MPLBACKEND' not in os.environ
+                and not os.environ.get('DISPLAY') and not os.environ.get('WAYLAND_DISPLAY')):
+            matplotlib.use('Agg')
+    
+    import matplotlib.pyplot as plt
+    return plt
+
+def _to_soa(boxes, labels, scores=None):
+    """
+    Normaliza as detecções para arrays paralelos (SoA), uma conversão por chamada
+    Retorna boxes (N, 4) float64 (ou None), labels (N,) int64 e scores (N,) float64
+    (None se ausentes ou vazios)
+    """
+    if boxes is not None:
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    labels = np.asarray(labels, dtype=np.int64).reshape(-1)
+    if scores is not None and len(scores) > 0:
+        scores = np.asarray(scores, dtype=np.float64).reshape(-1)
+    else:
+        scores = None
+    return boxes, labels, scores
+
+def _box_collection(boxes, edgecolors, linewidths):
+    """
+    Um único LineCollection rasterizado com o contorno de todas as boxes de um eixo
+    (eixos e textos continuam vetoriais no PDF/SVG)
+    Cor (RGBA, com o alpha embutido) e espessura podem ser arrays, uma por box
+    """
+    # Contorno fechado de cada box: (x1,y1) (x2,y1) (x2,y2) (x1,y2) (x1,y1) -> (N, 5, 2)
+    outlines = boxes[:, [0, 1, 2, 1, 2, 3, 0, 3, 0, 1]].reshape(-1, 5, 2)
+    from matplotlib.collections import LineCollection
+    
+    coll = LineCollection(outlines, colors=edgecolors, linewidths=linewidths)
+    coll.set_rasterized(True)
+    return coll
+
+def _draw_labels(ax, boxes, texts, text_colors, max_labels=None):
+    """
+    Escreve os labels acima das boxes (no máximo max_labels), com um único
+    PolyCollection de retângulos brancos como fundo de todos eles
+    """
+    from matplotlib.backends.backend_agg import RendererAgg
+    from matplotlib.collections import PolyCollection
+    from matplotlib.font_manager import FontProperties
+    
+    n = len(texts) if max_labels is None else min(len(texts), max_labels)
+    if n == 0:
+        return
+    
+    texts = texts[:n]
+    anchors = np.column_stack((boxes[:n, 0], boxes[:n, 1] - 0.01))
+    
+    for (x, y), text, color in zip(anchors.tolist(), texts, text_colors[:n]):
+        ax.text(x, y, text, color=color, fontsize=LABEL_FONTSIZE, zorder=3)
+    
+    # Tamanho de cada texto (em polegadas, relativo à âncora), medido uma vez por texto distinto
+    # Medido com um renderer Agg próprio: nem todo canvas tem get_renderer (SVG, PDF, PGF, Cairo)
+    renderer = RendererAgg(1, 1, ax.figure.dpi)
+    prop = FontProperties(size=LABEL_FONTSIZE)
+    px_per_inch = renderer.points_to_pixels(72)
+    sizes = {}
+    for text in texts:
+        if text not in sizes:
+            sizes[text] = renderer.get_text_width_height_descent(text, prop, ismath=False)
+    w, h, d = np.array([sizes[text] for text in texts]).T / px_per_inch
+    
+    # Retângulo de fundo de cada label, com o mesmo padding do boxstyle anterior
+    pad = LABEL_PAD * LABEL_FONTSIZE / 72
+    left, right = np.full(n, -pad), w + pad
+    bottom, top = -d - pad, h - d + pad
+    corners = np.stack((left, bottom, right, bottom, right, top, left, top), axis=1)
+    
+    # Vértices em polegadas (não dependem do layout); só as âncoras ficam em coordenadas de dados
+    background = PolyCollection(corners.reshape(-1, 4, 2), offsets=anchors,
+                                offset_transform=ax.transData,
+                                transform=ax.figure.dpi_scale_trans,
+                                facecolors='white', edgecolors='black',
+                                linewidths=1, alpha=0.7, zorder=2.5)
+    ax.add_collection(background, autolim=False)
 
 def plot_boxes_comparison(image_path, original_boxes, processed_boxes, 
                           original_labels, processed_labels, 
-                          processed_scores=None, title="Comparação"):
+                          processed_scores=None, title="Comparação", max_labels=None):
     """
     Plota comparação entre boxes originais e processadas
     
@@ -23,11 +119,14 @@ def plot_boxes_comparison(image_path, original_boxes, processed_boxes,
         processed_labels: labels processadas
         processed_scores: scores das boxes processadas (opcional)
         title: título do plot
+        max_labels: máximo de labels escritos por eixo (None = todos)
     """
-    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(16, 8))
+    plt = _pyplot()
+    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(16, 8), layout='constrained')
     
-    # Cores por classe
-    colors = plt.cm.tab10(np.linspace(0, 1, 10))
+    original_boxes, original_labels, _ = _to_soa(original_boxes, original_labels)
+    processed_boxes, processed_labels, processed_scores = _to_soa(
+        processed_boxes, processed_labels, processed_scores)
     
     # Plot 1: Boxes Originais
     ax1.set_title(f'Original ({len(original_boxes)} boxes)', fontsize=14, fontweight='bold')
@@ -35,22 +134,15 @@ def plot_boxes_comparison(image_path, original_boxes, processed_boxes,
     ax1.set_ylim(1, 0)  # Inverter Y
     ax1.set_aspect('equal')
     
-    for box, label in zip(original_boxes, original_labels):
-        x1, y1, x2, y2 = box
-        width = x2 - x1
-        height = y2 - y1
-        
-        rect = patches.Rectangle(
-            (x1, y1), width, height,
-            linewidth=2, edgecolor=colors[label % 10],
-            facecolor='none', alpha=0.7
-        )
-        ax1.add_patch(rect)
-        
-        # Label
-        ax1.text(x1, y1-0.01, f'C{label}', 
-                color=colors[label % 10], fontsize=8,
-                bbox=dict(boxstyle='round,pad=0.3', facecolor='white', alpha=0.7))
+    # Cores por classe, (N, 4) RGBA de uma vez
+    text_colors = _TAB10_RGBA[original_labels % 10]
+    edge_colors = text_colors.copy()
+    edge_colors[:, 3] = 0.7
+    ax1.add_collection(_box_collection(original_boxes, edge_colors, 2))
+    
+    # Label
+    _draw_labels(ax1, original_boxes, [f'C{label}' for label in original_labels.tolist()],
+                 text_colors, max_labels)
     
     # Plot 2: Boxes Processadas
     ax2.set_title(f'Processado ({len(processed_boxes)} boxes)', fontsize=14, fontweight='bold')
@@ -58,53 +150,55 @@ def plot_boxes_comparison(image_path, original_boxes, processed_boxes,
     ax2.set_ylim(1, 0)
     ax2.set_aspect('equal')
     
-    for i, (box, label) in enumerate(zip(processed_boxes, processed_labels)):
-        x1, y1, x2, y2 = box
-        width = x2 - x1
-        height = y2 - y1
-        
-        # Cor baseada no score se disponível
-        if processed_scores:
-            score = processed_scores[i]
-            alpha = 0.5 + (score * 0.5)  # Alpha baseado no score
-            linewidth = 1 + (score * 2)   # Espessura baseada no score
-        else:
-            alpha = 0.7
-            linewidth = 2
-        
-        rect = patches.Rectangle(
-            (x1, y1), width, height,
-            linewidth=linewidth, edgecolor=colors[label % 10],
-            facecolor='none', alpha=alpha
-        )
-        ax2.add_patch(rect)
-        
-        # Label com score
-        if processed_scores:
-            label_text = f'C{label} ({processed_scores[i]:.2f})'
-        else:
-            label_text = f'C{label}'
-        
-        ax2.text(x1, y1-0.01, label_text,
-                color=colors[label % 10], fontsize=8,
-                bbox=dict(boxstyle='round,pad=0.3', facecolor='white', alpha=0.7))
+    text_colors = _TAB10_RGBA[processed_labels % 10]
+    edge_colors = text_colors.copy()
+    
+    # Cor baseada no score se disponível
+    if processed_scores is not None:
+        edge_colors[:, 3] = 0.5 + (processed_scores * 0.5)  # Alpha baseado no score
+        linewidths = 1 + (processed_scores * 2)             # Espessura baseada no score
+        label_texts = [f'C{label} ({score:.2f})'
+                       for label, score in zip(processed_labels.tolist(),
+                                               processed_scores.tolist())]
+    else:
+        edge_colors[:, 3] = 0.7
+        linewidths = 2
+        label_texts = [f'C{label}' for label in processed_labels.tolist()]
+    
+    ax2.add_collection(_box_collection(processed_boxes, edge_colors, linewidths))
+    
+    # Label com score
+    _draw_labels(ax2, processed_boxes, label_texts, text_colors, max_labels)
     
     plt.suptitle(title, fontsize=16, fontweight='bold')
-    plt.tight_layout()
     
     return fig
 
+# A partir deste número de scores o histograma é desenhado com ax.stairs
+STAIRS_MIN_SCORES = 100_000
+
 def plot_score_distribution(scores, approach_name, bins=20):
     """
     Plota distribuição de scores
     """
-    fig, ax = plt.subplots(figsize=(10, 6))
-    
-    ax.hist(scores, bins=bins, edgecolor='black', alpha=0.7)
-    ax.axvline(np.mean(scores), color='red', linestyle='--', 
-               linewidth=2, label=f'Média: {np.mean(scores):.3f}')
-    ax.axvline(np.median(scores), color='green', linestyle='--',
-               linewidth=2, label=f'Mediana: {np.median(scores):.3f}')
+    plt = _pyplot()
+    fig, ax = plt.subplots(figsize=(10, 6), layout='constrained')
+    
+    # Converter uma única vez para histograma, média e mediana
+    scores = np.asarray(scores, dtype=np.float64)
+    mean = scores.mean()
+    median = np.median(scores)
+    
+    # Muitos scores: histograma em um único artista (stairs) em vez de um patch por barra
+    if scores.size >= STAIRS_MIN_SCORES:
+        counts, edges = np.histogram(scores, bins=bins)
+        ax.stairs(counts, edges, fill=True, edgecolor='black', linewidth=1, alpha=0.7)
+    else:
+        ax.hist(scores, bins=bins, edgecolor='black', alpha=0.7)
+    ax.axvline(mean, color='red', linestyle='--', 
+               linewidth=2, label=f'Média: {mean:.3f}')
+    ax.axvline(median, color='green', linestyle='--',
+               linewidth=2, label=f'Mediana: {median:.3f}')
     
     ax.set_xlabel('Score', fontsize=12)
     ax.set_ylabel('Frequência', fontsize=12)
@@ -115,28 +209,39 @@ def plot_score_distribution(scores, approach_name, bins=20):
     
     return fig
 
+def class_mean_scores(labels, scores):
+    """
+    Score médio por classe com np.bincount (uma passada, O(N))
+    Retorna array indexado pelo id da classe (0 para classes ausentes)
+    """
+    labels = np.asarray(labels, dtype=np.int64)
+    counts = np.bincount(labels)
+    sums = np.bincount(labels, weights=np.asarray(scores, dtype=np.float64))
+    return sums / np.maximum(counts, 1)
+
 def plot_class_distribution(labels, scores=None, title="Distribuição por Classe"):
     """
     Plota distribuição de boxes por classe
     """
-    class_counts = Counter(labels)
+    _, labels, scores = _to_soa(None, labels, scores)
     
-    fig, ax = plt.subplots(figsize=(12, 6))
+    plt = _pyplot()
+    fig, ax = plt.subplots(figsize=(12, 6), layout='constrained')
     
-    classes = sorted(class_counts.keys())
-    counts = [class_counts[c] for c in classes]
+    classes = np.unique(labels)
+    counts = np.bincount(labels)[classes]
     
     bars = ax.bar(classes, counts, edgecolor='black', alpha=0.7)
     
     # Colorir barras baseado no score médio se disponível
-    if scores:
-        for i, class_id in enumerate(classes):
-            class_scores = [s for l, s in zip(labels, scores) if l == class_id]
-            avg_score = np.mean(class_scores)
-            
-            # Cor baseada no score
-            color = plt.cm.RdYlGn(avg_score)
-            bars[i].set_facecolor(color)
+    if scores is not None:
+        avg_scores = class_mean_scores(labels, scores)[classes]
+        
+        # Cor baseada no score: uma consulta ao colormap para todas as barras
+        bar_colors = plt.cm.RdYlGn(avg_scores)
+        
+        for i, (class_id, avg_score) in enumerate(zip(classes, avg_scores)):
+            bars[i].set_facecolor(bar_colors[i])
             
             # Adicionar score médio no topo da barra
             ax.text(class_id, counts[i], f'{avg_score:.2f}',
@@ -162,28 +267,31 @@ def compare_approaches_plot(results_dict):
             }
         }
     """
-    fig, axes = plt.subplots(2, 2, figsize=(14, 10))
+    plt = _pyplot()
+    fig, axes = plt.subplots(2, 2, figsize=(14, 10), layout='constrained')
     
     approach_names = list(results_dict.keys())
     
+    # Converter cada lista de scores uma única vez; os 4 gráficos reutilizam estes arrays
+    results = [results_dict[name] for name in approach_names]
+    n_boxes = np.array([len(r['boxes']) for r in results])
+    scores_data = [np.asarray(r['scores'], dtype=np.float64) for r in results]
+    avg_scores = np.array([s.mean() if s.size else 0.0 for s in scores_data])
+    
     # 1. Quantidade de boxes
     ax = axes[0, 0]
-    n_boxes = [len(results_dict[name]['boxes']) for name in approach_names]
     bars = ax.bar(approach_names, n_boxes, edgecolor='black', alpha=0.7)
     ax.set_ylabel('Número de Boxes', fontsize=11)
     ax.set_title('Quantidade de Boxes por Abordagem', fontsize=12, fontweight='bold')
     ax.grid(True, alpha=0.3, axis='y')
     
     # Adicionar valores nas barras
-    for bar, val in zip(bars, n_boxes):
+    for bar, val in zip(bars, n_boxes.tolist()):
         ax.text(bar.get_x() + bar.get_width()/2, val,
                f'{val}', ha='center', va='bottom', fontsize=10, fontweight='bold')
     
     # 2. Score médio
     ax = axes[0, 1]
-    avg_scores = [np.mean(results_dict[name]['scores']) 
-                  if results_dict[name]['scores'] else 0 
-                  for name in approach_names]
     bars = ax.bar(approach_names, avg_scores, edgecolor='black', alpha=0.7,
                   color=['#2ecc71', '#3498db', '#e74c3c'])
     ax.set_ylabel('Score Médio', fontsize=11)
@@ -191,14 +299,14 @@ def compare_approaches_plot(results_dict):
     ax.set_ylim(0, 1)
     ax.grid(True, alpha=0.3, axis='y')
     
-    for bar, val in zip(bars, avg_scores):
+    for bar, val in zip(bars, avg_scores.tolist()):
         ax.text(bar.get_x() + bar.get_width()/2, val,
                f'{val:.3f}', ha='center', va='bottom', fontsize=10, fontweight='bold')
     
     # 3. Distribuição de scores (boxplot)
     ax = axes[1, 0]
-    scores_data = [results_dict[name]['scores'] for name in approach_names]
-    bp = ax.boxplot(scores_data, labels=approach_names, patch_artist=True)
+    bp = ax.boxplot(scores_data, patch_artist=True)
+    ax.set_xticklabels(approach_names)
     
     for patch, color in zip(bp['boxes'], ['#2ecc71', '#3498db', '#e74c3c']):
         patch.set_facecolor(color)
@@ -215,7 +323,7 @@ def compare_approaches_plot(results_dict):
     # (ou você pode passar o total original separadamente)
     if len(approach_names) > 0:
         baseline = n_boxes[0]
-        reductions = [(baseline - n) / baseline * 100 for n in n_boxes]
+        reductions = (baseline - n_boxes) / baseline * 100
         
         bars = ax.bar(approach_names, reductions, edgecolor='black', alpha=0.7,
                      color=['#95a5a6', '#3498db', '#e74c3c'])
@@ -224,13 +332,12 @@ def compare_approaches_plot(results_dict):
         ax.axhline(y=0, color='black', linestyle='-', linewidth=0.5)
         ax.grid(True, alpha=0.3, axis='y')
         
-        for bar, val in zip(bars, reductions):
+        for bar, val in zip(bars, reductions.tolist()):
             ax.text(bar.get_x() + bar.get_width()/2, val,
                    f'{val:.1f}%', ha='center', 
                    va='bottom' if val >= 0 else 'top',
                    fontsize=10, fontweight='bold')
     
-    plt.tight_layout()
     return fig
 
 def save_comparison_report(results_dict, output_path='comparison_report.png'):
@@ -242,6 +349,55 @@ def save_comparison_report(results_dict, output_path='comparison_report.png'):
     print(f"✓ Relatório salvo em: {output_path}")
     return fig
 
+# Limites das faixas de qualidade (baixa / média / alta)
+QUALITY_THRESHOLDS = np.array([0.4, 0.7])
+
+@lru_cache(maxsize=None)
+def _score_stats_kernel():
+    """
+    Kernel Numba de score_stats, importado e compilado na primeira chamada
+    (importar o módulo não paga o Numba); None se o Numba não estiver instalado
+    """
+    try:
+        from numba import njit
+    except ImportError:
+        return None
+    
+    @njit('UniTuple(f8, 4)(f8[:])', cache=True)
+    def kernel(scores):
+        """Média, desvio padrão, mínimo e máximo em uma única passada"""
+        n = scores.shape[0]
+        mn = scores[0]
+        mx = scores[0]
+        total = 0.0
+        total_sq = 0.0
+        for i in range(n):
+            v = scores[i]
+            total += v
+            total_sq += v * v
+            if v < mn:
+                mn = v
+            if v > mx:
+                mx = v
+        
+        mean = total / n
+        return mean, max(total_sq / n - mean * mean, 0.0) ** 0.5, mn, mx
+    
+    return kernel
+
+def score_stats(scores):
+    """
+    (média, desvio padrão, mínimo, máximo) de um array float64 não vazio
+    Kernel Numba de uma passada se disponível, senão reduções NumPy
+    """
+    kernel = _score_stats_kernel()
+    if kernel is not None:
+        return kernel(np.ascontiguousarray(scores, dtype=np.float64))
+    
+    mean = scores.mean()
+    std = np.sqrt(np.mean(np.square(scores - mean)))
+    return mean, std, scores.min(), scores.max()
+
 def print_statistics(boxes, scores, labels, approach_name):
     """
     Imprime estatísticas detalhadas
@@ -253,31 +409,37 @@ def print_statistics(boxes, scores, labels, approach_name):
     print(f"\nGeral:")
     print(f"  Total de boxes: {len(boxes)}")
     
-    if scores:
-        print(f"  Score médio: {np.mean(scores):.3f}")
+    # Converter uma única vez; todas as reduções usam os mesmos arrays
+    _, labels, scores = _to_soa(None, labels, scores)
+    has_scores = scores is not None
+    if has_scores:
+        mean, std, score_min, score_max = score_stats(scores)
+        
+        print(f"  Score médio: {mean:.3f}")
         print(f"  Score mediano: {np.median(scores):.3f}")
-        print(f"  Score mín/máx: {np.min(scores):.3f} / {np.max(scores):.3f}")
-        print(f"  Desvio padrão: {np.std(scores):.3f}")
+        print(f"  Score mín/máx: {score_min:.3f} / {score_max:.3f}")
+        print(f"  Desvio padrão: {std:.3f}")
     
     # Por classe
-    class_counts = Counter(labels)
+    class_counts = np.bincount(labels)
+    if has_scores:
+        avg_scores = class_mean_scores(labels, scores)
     print(f"\nPor Classe:")
     
-    for class_id in sorted(class_counts.keys()):
+    for class_id in np.unique(labels):
         count = class_counts[class_id]
         
-        if scores:
-            class_scores = [s for l, s in zip(labels, scores) if l == class_id]
-            avg_score = np.mean(class_scores)
+        if has_scores:
+            avg_score = avg_scores[class_id]
             print(f"  Classe {class_id}: {count} boxes (score médio: {avg_score:.3f})")
         else:
             print(f"  Classe {class_id}: {count} boxes")
     
     # Distribuição de qualidade
-    if scores:
-        high = sum(1 for s in scores if s >= 0.7)
-        medium = sum(1 for s in scores if 0.4 <= s < 0.7)
-        low = sum(1 for s in scores if s < 0.4)
+    if has_scores:
+        # Baixa (<0.4) = 0, Média (0.4-0.7) = 1, Alta (≥0.7) = 2, em uma passada
+        buckets = np.searchsorted(QUALITY_THRESHOLDS, scores, side='right')
+        low, medium, high = np.bincount(buckets, minlength=3).tolist()
         
         print(f"\nDistribuição de Qualidade:")
         print(f"  Alta (≥0.7): {high} ({high/len(scores)*100:.1f}%)")